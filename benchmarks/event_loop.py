@@ -0,0 +1,104 @@
+# coding: utf-8
+
+# $Id: $
+
+# Event loop policy throughput benchmark.
+#
+# Starts dvasya worker application in child process with each event loop
+# policy and measures requests per second for several keep-alive
+# connections. Client runs in parent process with default event loop and
+# sends raw HTTP requests, so its overhead is the same for all policies.
+# Policies which can't be imported are skipped.
+#
+# usage: python benchmarks/event_loop.py [policy class path ...]
+import asyncio
+import os
+import signal
+import sys
+import time
+
+os.environ.setdefault("DVASYA_SETTINGS_MODULE", 'testapp.settings')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web  # noqa
+from dvasya.logging import getLogger  # noqa
+from dvasya.middleware import load_middlewares  # noqa
+from dvasya.server import bind_socket  # noqa
+from dvasya.urls import load_resolver  # noqa
+from dvasya.utils import set_event_loop_policy  # noqa
+
+POLICIES = [None, 'uvloop.EventLoopPolicy']
+
+CONNECTIONS = 16
+REQUESTS = 2000
+REQUEST = b'GET /function/ HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+logger = getLogger('dvasya.worker')
+
+
+def serve(sock, policy):
+    """ Runs worker application forever in child process."""
+    set_event_loop_policy(policy, logger)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    app = web.Application(router=load_resolver().autodiscover(), loop=loop,
+                          middlewares=load_middlewares())
+    loop.run_until_complete(loop.create_server(app.make_handler(),
+                                               sock=sock))
+    loop.run_forever()
+
+
+@asyncio.coroutine
+def client(address, count, loop):
+    reader, writer = yield from asyncio.open_connection(*address, loop=loop)
+    for _ in range(count):
+        writer.write(REQUEST)
+        length = 0
+        while True:
+            line = yield from reader.readline()
+            if line == b'\r\n':
+                break
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        yield from reader.readexactly(length)
+    writer.close()
+
+
+def bench(policy):
+    sock = bind_socket(('127.0.0.1', 0))
+    address = sock.getsockname()
+    pid = os.fork()
+    if not pid:
+        serve(sock, policy)
+        os._exit(0)
+    sock.close()
+    loop = asyncio.new_event_loop()
+    try:
+        # warm up and wait for server start
+        loop.run_until_complete(client(address, 10, loop))
+        start = time.monotonic()
+        loop.run_until_complete(asyncio.gather(
+            *[client(address, REQUESTS // CONNECTIONS, loop)
+              for _ in range(CONNECTIONS)], loop=loop))
+        return REQUESTS / (time.monotonic() - start)
+    finally:
+        loop.close()
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+
+def main():
+    policies = sys.argv[1:] or POLICIES
+    print("%30s %10s" % ('policy', 'rps'))
+    for policy in policies:
+        if policy:
+            try:
+                __import__(policy.rsplit('.', 1)[0])
+            except ImportError:
+                print("%30s %10s" % (policy, 'skipped'))
+                continue
+        print("%30s %10.0f" % (policy or 'asyncio', bench(policy)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# coding: utf-8
+
+# $Id: $
+
+# Match info handler benchmark.
+#
+# Measures per-request cost of calling a view through RegexMatchInfo handler
+# for views classified at url-compile time and for generic coroutine wrapper
+# used for all views before. Reports time, python frames entered (every
+# generator or function frame is an allocation) and peak traced memory per
+# request.
+#
+# usage: python benchmarks/match_info.py
+import asyncio
+import os
+import sys
+import timeit
+import tracemalloc
+
+os.environ.setdefault("DVASYA_SETTINGS_MODULE", 'testapp.settings')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dvasya.urls import RegexMatchInfo, get_view_kind, VIEW_SYNC  # noqa
+from dvasya.views import View  # noqa
+
+NUMBER = 100000
+
+
+class Request:
+    method = 'GET'
+
+
+@asyncio.coroutine
+def coroutine_view(request, *args, **kwargs):
+    return 'response'
+
+
+def generator_view(request, *args, **kwargs):
+    if False:
+        yield
+    return 'response'
+
+
+def sync_view(request, *args, **kwargs):
+    return 'response'
+
+
+class ClassView(View):
+    def get(self, request, *args, **kwargs):
+        return 'response'
+
+
+def run(result):
+    """ Runs coroutine without event loop, as it never yields."""
+    try:
+        result.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("coroutine suspended")
+
+
+def handle(view, kind, request):
+    match_info = RegexMatchInfo(view, (1,), {'key': 'value'}, kind)
+    return run(match_info.handler(request))
+
+
+def count_frames(view, kind, request):
+    calls = []
+
+    def profile(frame, event, arg):
+        if event == 'call':
+            calls.append(frame)
+
+    sys.setprofile(profile)
+    handle(view, kind, request)
+    sys.setprofile(None)
+    # profile() itself is not reported, setprofile(None) is a C call
+    return len(calls)
+
+
+def peak_memory(view, kind, request):
+    handle(view, kind, request)
+    tracemalloc.start()
+    handle(view, kind, request)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench(view, kind, request):
+    timer = timeit.Timer(lambda: handle(view, kind, request))
+    best = min(timer.repeat(repeat=3, number=NUMBER))
+    return best / NUMBER * 1e6
+
+
+def main():
+    request = Request()
+    views = (
+        ('coroutine', coroutine_view),
+        ('generator', generator_view),
+        ('class', ClassView.as_view()),
+        ('sync', sync_view),
+    )
+    print("%10s %10s %8s %8s %8s" % (
+        'view', 'handler', 'us', 'frames', 'peak, B'))
+    for title, view in views:
+        assert handle(view, get_view_kind(view), request) == 'response'
+        for handler, kind in (('wrapper', VIEW_SYNC),
+                              ('direct', get_view_kind(view))):
+            if handler == 'direct' and kind is VIEW_SYNC:
+                continue
+            print("%10s %10s %8.2f %8d %8d" % (
+                title, handler, bench(view, kind, request),
+                count_frames(view, kind, request),
+                peak_memory(view, kind, request)))
+
+
+if __name__ == '__main__':
+    main()
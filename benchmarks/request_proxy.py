@@ -0,0 +1,119 @@
+# coding: utf-8
+
+# $Id: $
+
+# Request proxy benchmark.
+#
+# Measures per-request cost of creating DvasyaRequestProxy and reading
+# attributes typical view reads (method, path, GET and a couple of META
+# keys), for current slotted proxy and for legacy proxy copied below.
+# Reports time and peak traced memory per request.
+#
+# usage: python benchmarks/request_proxy.py
+import os
+import sys
+import timeit
+import tracemalloc
+
+os.environ.setdefault("DVASYA_SETTINGS_MODULE", 'testapp.settings')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp.multidict import CIMultiDict, MultiDict  # noqa
+from dvasya.request import DvasyaRequestProxy  # noqa
+
+NUMBER = 100000
+
+HEADERS = CIMultiDict([
+    ('Host', 'example.com'),
+    ('User-Agent', 'Mozilla/5.0 (X11; Linux x86_64)'),
+    ('Accept', 'text/html,application/xhtml+xml'),
+    ('Accept-Encoding', 'gzip, deflate'),
+    ('Accept-Language', 'en-US,en;q=0.5'),
+    ('Cookie', 'sessionid=abc'),
+    ('X-Real-IP', '10.0.0.1'),
+    ('X-Forwarded-For', '10.0.0.1'),
+    ('Connection', 'keep-alive'),
+])
+
+
+class LegacyRequestProxy(object):
+    """ DvasyaRequestProxy before it was slotted."""
+
+    def __init__(self, request):
+        self.__request = request
+        self.POST = {}
+        self.FILES = {}
+        self._meta = None
+
+    def __getattr__(self, item):
+        try:
+            return getattr(self.__request, item)
+        except AttributeError:
+            return super().__getattribute__(item)
+
+    @property
+    def META(self):
+        if self._meta:
+            return self._meta
+        transport = self.__request.transport
+        remote_addr, remote_port = transport.get_extra_info("peername")
+        self._meta = {
+            'REMOTE_ADDR': remote_addr,
+            "REMOTE_PORT": remote_port
+        }
+        for k, v in self.__request.headers.items():
+            if '_' in k:
+                continue
+            key = k.upper().replace('-', '_')
+            self._meta[key] = v
+        return self._meta
+
+
+class Transport:
+    @staticmethod
+    def get_extra_info(name):
+        return '10.0.0.2', 54321
+
+
+class Request:
+    method = 'GET'
+    path = '/path/'
+    GET = MultiDict([('page', '1')])
+    headers = HEADERS
+    transport = Transport()
+
+
+def handle(proxy_class, request):
+    proxy = proxy_class(request)
+    return (proxy.method, proxy.path, proxy.GET.get('page'),
+            proxy.META.get('X_REAL_IP'), proxy.META.get('REMOTE_ADDR'))
+
+
+def peak_memory(proxy_class, request):
+    handle(proxy_class, request)
+    tracemalloc.start()
+    handle(proxy_class, request)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench(proxy_class, request):
+    timer = timeit.Timer(lambda: handle(proxy_class, request))
+    best = min(timer.repeat(repeat=3, number=NUMBER))
+    return best / NUMBER * 1e6
+
+
+def main():
+    request = Request()
+    print("%10s %8s %8s" % ('proxy', 'us', 'peak, B'))
+    for title, proxy_class in (('legacy', LegacyRequestProxy),
+                               ('slotted', DvasyaRequestProxy)):
+        assert handle(proxy_class, request) == (
+            'GET', '/path/', '1', '10.0.0.1', '10.0.0.2')
+        print("%10s %8.2f %8d" % (title, bench(proxy_class, request),
+                                  peak_memory(proxy_class, request)))
+
+
+if __name__ == '__main__':
+    main()
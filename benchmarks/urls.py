@@ -0,0 +1,80 @@
+# coding: utf-8
+
+# $Id: $
+
+# Url resolver benchmark.
+#
+# Measures UrlResolver.resolve_path() cost against route count for linear
+# and compiled url resolvers. Every generated urlconf has half of its routes
+# in a nested include; first, middle and last routes are resolved.
+#
+# usage: python benchmarks/urls.py [ROUTE_COUNT ...]
+import os
+import sys
+import timeit
+import types
+
+os.environ.setdefault("DVASYA_SETTINGS_MODULE", 'testapp.settings')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dvasya.urls import url, include, UrlResolver, CompiledUrlResolver  # noqa
+
+ROUTE_COUNTS = (10, 50, 100, 300, 1000)
+
+NUMBER = 20000
+
+
+def view(request, *args, **kwargs):
+    return None
+
+
+def make_urlconf(route_count):
+    """ Creates urlconf module with route_count routes."""
+    half = route_count // 2
+    included = [url(r'^item%d/(?P<pk>\d+)/$' % i, view)
+                for i in range(half, route_count)]
+    urlpatterns = [url(r'^resource%d/(\d+)/$' % i, view)
+                   for i in range(half)]
+    urlpatterns.append(url(r'^api/', include(included)))
+    module = types.ModuleType('bench_urls_%d' % route_count)
+    module.urlpatterns = urlpatterns
+    sys.modules[module.__name__] = module
+    return module.__name__
+
+
+def get_paths(route_count):
+    half = route_count // 2
+    return (
+        ('first', 'resource0/1/'),
+        ('middle', 'resource%d/1/' % (half - 1)),
+        ('last', 'api/item%d/1/' % (route_count - 1)),
+    )
+
+
+def bench(resolver, path):
+    timer = timeit.Timer(lambda: resolver.resolve_path(path))
+    best = min(timer.repeat(repeat=3, number=NUMBER))
+    return best / NUMBER * 1e6
+
+
+def main():
+    route_counts = [int(c) for c in sys.argv[1:]] or ROUTE_COUNTS
+    print("%8s %8s %12s %12s %8s" % (
+        'routes', 'path', 'linear, us', 'compiled, us', 'speedup'))
+    for route_count in route_counts:
+        urlconf = make_urlconf(route_count)
+        linear = UrlResolver(root_urlconf=urlconf)
+        # compiled resolver indexes shared include patterns, so linear one is
+        # created from separate urlconf instance
+        compiled = CompiledUrlResolver(root_urlconf=make_urlconf(route_count))
+        for title, path in get_paths(route_count):
+            assert linear.resolve_path(path) == compiled.resolve_path(path)
+            linear_time = bench(linear, path)
+            compiled_time = bench(compiled, path)
+            print("%8d %8s %12.2f %12.2f %7.1fx" % (
+                route_count, title, linear_time, compiled_time,
+                linear_time / compiled_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+# $Id: $
+
+# Class-based view dispatch benchmark.
+#
+# Compares per-request cost of class-based view call for previous
+# hasattr/getattr-based dispatch, per-class dispatch table and stateless
+# view instance.
+#
+# usage: python benchmarks/views.py
+import asyncio
+import os
+import sys
+import timeit
+
+os.environ.setdefault("DVASYA_SETTINGS_MODULE", 'testapp.settings')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dvasya.views import View  # noqa
+
+NUMBER = 100000
+
+
+class Request:
+    method = 'GET'
+
+
+class LegacyView(View):
+    """ View with dispatch procedure from dvasya 0.13."""
+
+    @classmethod
+    def as_view(cls, **init_kwargs):
+        def view(request, *args, **kwargs):
+            self = cls(**init_kwargs)
+            if hasattr(self, 'get') and not hasattr(self, 'head'):
+                self.head = self.get
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return self.dispatch(request, *args, **kwargs)
+        return view
+
+    @asyncio.coroutine
+    def dispatch(self, request, *args, **kwargs):
+        self.request = request
+        self.args = args
+        self.kwargs = kwargs
+        method = request.method.lower()
+        if method in self.http_method_names:
+            handler = getattr(self, method,
+                              self.http_method_not_allowed)
+        else:
+            handler = self.http_method_not_allowed
+
+        result = handler(request, *args, **kwargs)
+        if asyncio.iscoroutine(result):
+            result = yield from result
+        return result
+
+    def _allowed_methods(self):
+        return sorted([m.upper() for m in self.http_method_names
+                       if hasattr(self, m)])
+
+
+def get(self, request, *args, **kwargs):
+    return 'response'
+
+
+class Legacy(LegacyView):
+    get = get
+
+
+class Table(View):
+    get = get
+
+
+class Stateless(View):
+    stateless = True
+    get = get
+
+
+def run(result):
+    """ Runs coroutine without event loop, as it never yields."""
+    if not asyncio.iscoroutine(result):
+        return result
+    try:
+        result.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("coroutine suspended")
+
+
+def bench(view, method):
+    request = Request()
+    request.method = method
+    assert run(view(request, 1, key='value')) is not None
+    timer = timeit.Timer(lambda: run(view(request, 1, key='value')))
+    best = min(timer.repeat(repeat=3, number=NUMBER))
+    return best / NUMBER * 1e6
+
+
+def main():
+    views = (
+        ('legacy', Legacy.as_view()),
+        ('table', Table.as_view()),
+        ('stateless', Stateless.as_view()),
+    )
+    print("%10s %10s %10s" % ('view', 'GET, us', 'PATCH, us'))
+    for title, view in views:
+        print("%10s %10.2f %10.2f" % (
+            title, bench(view, 'GET'), bench(view, 'PATCH')))
+
+
+if __name__ == '__main__':
+    main()
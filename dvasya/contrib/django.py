@@ -15,6 +15,8 @@ from dvasya.urls import UrlResolver
 
 from dvasya.cookies import parse_cookie
 from dvasya.middleware import RequestProxyMiddleware
+from dvasya.request import get_max_body_size, get_peer_address
+from dvasya.request import parse_form
 
 
 class DjangoRequestProxy(HttpRequest):
@@ -33,8 +35,8 @@ class DjangoRequestProxy(HttpRequest):
         self._init_meta(request)
 
     def post(self):
-        # FIXME: for now (aiohttp==1.14.x) payload is parsed by cgi parser
-        task = asyncio.Task(self.__request.post())
+        task = asyncio.Task(parse_form(self.__request,
+                                       get_max_body_size(self.__request)))
         task.add_done_callback(self._process_payload)
         return task
 
@@ -64,8 +66,7 @@ class DjangoRequestProxy(HttpRequest):
         return None
 
     def _init_meta(self, request):
-        transport = self.__request.transport
-        remote_addr, remote_port = transport.get_extra_info("peername")
+        remote_addr, remote_port = get_peer_address(self.__request.transport)
         meta = CIMultiDict({
             k.replace('-', '_'): v
             for k, v in request.headers.items()})
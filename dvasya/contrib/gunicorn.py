@@ -21,6 +21,7 @@ from dvasya.logging import getLogger
 from dvasya.conf import settings
 from dvasya.middleware import load_middlewares
 from dvasya.urls import UrlResolver, load_resolver
+from dvasya.utils import set_event_loop_policy
 
 
 class GunicornWorker(gaiohttp.AiohttpWorker):
@@ -34,6 +35,11 @@ class GunicornWorker(gaiohttp.AiohttpWorker):
         if os.environ.get('DJANGO_SETTINGS_MODULE'):
             self.install_django_handlers()
 
+    def init_process(self):
+        # event loop is created by AiohttpWorker.init_process()
+        set_event_loop_policy(settings.EVENT_LOOP_POLICY, self.logger)
+        super().init_process()
+
     def reinit_logging(self):
         """ Replaces handlers for dvasya loggers with gunicorn log handlers."""
         try:
@@ -73,7 +79,8 @@ class GunicornWorker(gaiohttp.AiohttpWorker):
         return self.wrap_protocol(proto)
 
     def get_factory(self, sock, addr):
-        application = web.Application(router=self.resolver_class(),
+        router = self.resolver_class.autodiscover()
+        application = web.Application(router=router,
                                       loop=self.loop,
                                       middlewares=self.middlewares,
                                       logger=self.log)
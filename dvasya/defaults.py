@@ -11,12 +11,43 @@ DEBUG = True
 # temporary directory for files
 FILE_UPLOAD_TEMP_DIR = '/tmp/'
 
+# size in bytes of uploaded file to spool it to FILE_UPLOAD_TEMP_DIR
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440
+
+# max total size in bytes of non-file multipart form fields, None for
+# unlimited
+DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440
+
+# max request body size in bytes, None for unlimited; could be overridden
+# for url pattern with url(..., max_body_size=...)
+MAX_BODY_SIZE = None
+
 DVASYA_MIDDLEWARES = [
     'dvasya.middleware.RequestProxyMiddleware',
 ]
 
 URL_RESOLVER_CLASS = 'dvasya.urls.UrlResolver'
 
+# max size of resolved paths cache for url resolver, 0 disables cache
+URL_RESOLVER_CACHE_SIZE = 1024
+
+# max size of memoized reverse() results, 0 disables memoization
+URL_REVERSE_CACHE_SIZE = 4096
+
+# record per-route timings of url resolver, middlewares and views
+# in per-worker histograms (see dvasya.stats)
+INSTRUMENTATION = False
+
+# seconds between event loop lag samples in workers, 0 disables monitor
+LOOP_LAG_INTERVAL = 0.1
+
+# event loop lag in seconds to log main thread stack of blocked worker
+LOOP_LAG_THRESHOLD = 0.5
+
+# full class path of workers event loop policy, i.e.
+# 'uvloop.EventLoopPolicy'; None for default asyncio event loop
+EVENT_LOOP_POLICY = None
+
 # internal logging setup
 LOGGING = {
     'disable_existing_loggers': False,
@@ -2,10 +2,14 @@
 
 # $Id: $
 import asyncio
-from aiohttp.web import Response, StreamResponse
+from collections import namedtuple
+import functools
+import inspect
+from aiohttp.web import HTTPException, Response, StreamResponse
 from dvasya.conf import settings
 from dvasya.request import DvasyaRequestProxy
 from dvasya.response import HttpInternalError
+from dvasya.stats import timed_middleware, view_timer
 from dvasya.utils import import_object
 
 
@@ -20,41 +24,31 @@ class DvasyaMiddlewareBase(object):
         self.app = app
         self.handler = handler
 
+    @classmethod
+    def get_hooks(cls):
+        """ Returns hooks overridden by middleware class.
+
+        Computed once per class.
+
+        @rtype: MiddlewareHooks
+        """
+        hooks = cls.__dict__.get('_hooks')
+        if hooks is None:
+            hooks = cls._hooks = MiddlewareHooks(
+                *(get_hook(cls, name) for name in MiddlewareHooks._fields))
+        return hooks
+
+    @classmethod
+    def get_chain(cls):
+        """ Returns single-middleware chain for the class."""
+        chain = cls.__dict__.get('_chain')
+        if chain is None:
+            chain = cls._chain = MiddlewareChain([cls])
+        return chain
+
     @asyncio.coroutine
     def __call__(self, request):
-        try:
-            # process request
-            ret = self.process_request(request)
-            if asyncio.iscoroutine(ret):
-                ret = yield from ret
-            # if process_request() returned none, call next middleware
-            if ret is None:
-                ret = self.handler(request)
-                if asyncio.iscoroutine(ret):
-                    ret = yield from ret
-            # passing response to process_response
-            response = ret
-        except Exception as e:
-            # process exception
-            ret = self.process_exception(request, e)
-            if asyncio.iscoroutine(ret):
-                ret = yield from ret
-            if ret is None:
-                if settings.DEBUG:
-                    return HttpInternalError(e)
-                raise
-            response = ret
-        # if has response from next middleware, or process_request, or
-        # process_exception, call process_response(response)
-
-        ret = self.process_response(request, response)
-        if asyncio.iscoroutine(ret):
-            ret = yield from ret
-        if not isinstance(ret, StreamResponse):
-            raise RuntimeError(
-                "%s.process_response() must return a StreamResponse"
-                % self.__class__.__name__)
-        return ret
+        return (yield from self.get_chain().run([self], self.handler, request))
 
     def process_request(self, request):
         """ called before handler.
@@ -86,6 +80,141 @@ class DvasyaMiddlewareBase(object):
         return response
 
 
+# overridden middleware hooks; each one is (function, is_async) or None
+MiddlewareHooks = namedtuple('MiddlewareHooks', (
+    'process_request', 'process_exception', 'process_response'))
+
+
+def get_hook(middleware_class, name):
+    """ Returns overridden middleware hook.
+
+    @return: unbound hook function and coroutine flag or None, if hook is
+        not overridden
+    @rtype: tuple
+    """
+    func = getattr(middleware_class, name)
+    if func is getattr(DvasyaMiddlewareBase, name):
+        return None
+    is_async = (asyncio.iscoroutinefunction(func) or
+                inspect.isgeneratorfunction(func))
+    return func, is_async
+
+
+class MiddlewareChain(object):
+    """ Flattened chain of DvasyaMiddlewareBase middlewares.
+
+    Runs process_request() hooks from outer to inner middleware, handler,
+    and then process_exception() and process_response() hooks from inner to
+    outer in single coroutine. Hooks not overridden by middleware classes are
+    skipped. Exception handling is the same as for nested middlewares.
+    """
+
+    def __init__(self, middleware_classes):
+        self.middleware_classes = list(middleware_classes)
+        self.hooks = [cls.get_hooks() for cls in self.middleware_classes]
+
+    @asyncio.coroutine
+    def factory(self, app, handler):
+        layers = [cls(app, handler) for cls in self.middleware_classes]
+        return functools.partial(self.run, layers, handler)
+
+    @asyncio.coroutine
+    def run(self, layers, handler, request):
+        hooks = self.hooks
+        response = None
+        error = None
+        depth = 0
+        # process_request() from outer to inner middleware
+        while depth < len(layers):
+            hook = hooks[depth].process_request
+            if hook is not None:
+                func, is_async = hook
+                try:
+                    ret = func(layers[depth], request)
+                    if is_async or asyncio.iscoroutine(ret):
+                        ret = yield from ret
+                except Exception as e:
+                    error = e
+                    break
+                if ret is not None:
+                    response = ret
+                    break
+            depth += 1
+        else:
+            # if no process_request() returned response, call handler
+            depth -= 1
+            try:
+                response = handler(request)
+                if asyncio.iscoroutine(response):
+                    response = yield from response
+            except Exception as e:
+                error = e
+
+        # process_exception() and process_response() from inner to outer
+        while depth >= 0:
+            layer = layers[depth]
+            layer_hooks = hooks[depth]
+            depth -= 1
+            if error is not None:
+                ret = None
+                hook = layer_hooks.process_exception
+                if hook is not None:
+                    func, is_async = hook
+                    try:
+                        ret = func(layer, request, error)
+                        if is_async or asyncio.iscoroutine(ret):
+                            ret = yield from ret
+                    except Exception as e:
+                        error = e
+                        continue
+                if ret is None:
+                    if settings.DEBUG and not isinstance(
+                            error, (asyncio.CancelledError, HTTPException)):
+                        # middleware returns error page without
+                        # process_response() call
+                        response = HttpInternalError(error)
+                        error = None
+                    continue
+                response = ret
+                error = None
+
+            hook = layer_hooks.process_response
+            if hook is not None:
+                func, is_async = hook
+                try:
+                    ret = func(layer, request, response)
+                    if is_async or asyncio.iscoroutine(ret):
+                        ret = yield from ret
+                except Exception as e:
+                    error = e
+                    continue
+            else:
+                ret = response
+            if not isinstance(ret, StreamResponse):
+                error = RuntimeError(
+                    "%s.process_response() must return a StreamResponse"
+                    % layer.__class__.__name__)
+                continue
+            response = ret
+
+        if error is not None:
+            raise error
+        return response
+
+
+def is_chainable(middleware_class):
+    """ Checks whether middleware could be added to MiddlewareChain.
+
+    Only DvasyaMiddlewareBase subclasses which don't override __call__() or
+    factory() are chainable.
+    """
+    if not issubclass(middleware_class, DvasyaMiddlewareBase):
+        return False
+    base = DvasyaMiddlewareBase
+    return (middleware_class.__call__ is base.__call__ and
+            middleware_class.factory.__func__ is base.factory.__func__)
+
+
 class RequestProxyMiddleware(DvasyaMiddlewareBase):
     request_class = DvasyaRequestProxy
     response_class = Response
@@ -96,6 +225,12 @@ class RequestProxyMiddleware(DvasyaMiddlewareBase):
             result = self.handler(proxy)
             if asyncio.iscoroutine(result):
                 result = yield from result
+        except asyncio.CancelledError:
+            # connection is closed, there is no one to show error page
+            raise
+        except HTTPException:
+            # i.e. 413 for too large request body, sent by aiohttp as is
+            raise
         except Exception as e:
             if settings.DEBUG:
                 return HttpInternalError(e)
@@ -115,10 +250,47 @@ class RequestProxyMiddleware(DvasyaMiddlewareBase):
 
 
 def load_middlewares():
+    """ Loads middleware factories from DVASYA_MIDDLEWARES setting.
+
+    Consecutive chainable middlewares are joined into MiddlewareChain.
+    If INSTRUMENTATION is enabled, middlewares are not joined and every
+    middleware and view call is timed.
+
+    @return: list of aiohttp middleware factories
+    @rtype: list
+    """
+    if settings.INSTRUMENTATION:
+        return load_timed_middlewares()
     result = []
+    chain = []
     for classname in settings.DVASYA_MIDDLEWARES:
         middleware_class = import_object(classname)
         if not hasattr(middleware_class, 'factory'):
             raise ValueError("Invalid middleware class %s" % classname)
+        if is_chainable(middleware_class):
+            chain.append(middleware_class)
+            continue
+        if chain:
+            result.append(MiddlewareChain(chain).factory)
+            chain = []
         result.append(middleware_class.factory)
+    if chain:
+        result.append(MiddlewareChain(chain).factory)
+    return result
+
+
+def load_timed_middlewares():
+    """ Loads middleware factories wrapped with timers.
+
+    @return: list of aiohttp middleware factories
+    @rtype: list
+    """
+    result = []
+    for classname in settings.DVASYA_MIDDLEWARES:
+        middleware_class = import_object(classname)
+        if not hasattr(middleware_class, 'factory'):
+            raise ValueError("Invalid middleware class %s" % classname)
+        stage = 'middleware:%s' % middleware_class.__name__
+        result.append(timed_middleware(middleware_class.factory, stage))
+    result.append(view_timer)
     return result
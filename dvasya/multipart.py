@@ -0,0 +1,197 @@
+# coding: utf-8
+
+# $Id: $
+
+# Incremental multipart/form-data parser.
+#
+# aiohttp reads whole request body to memory and parses it with cgi module,
+# so several large uploads could exhaust worker memory. This parser reads
+# request payload stream chunk by chunk and keeps in memory at most one
+# chunk plus boundary and part headers. File parts are written to
+# tempfile.SpooledTemporaryFile, which is moved from memory to
+# FILE_UPLOAD_TEMP_DIR when it grows above FILE_UPLOAD_MAX_MEMORY_SIZE.
+# Size of non-file fields is limited by DATA_UPLOAD_MAX_MEMORY_SIZE.
+#
+# @see https://tools.ietf.org/html/rfc7578
+import asyncio
+import cgi
+import tempfile
+
+from aiohttp.multidict import MultiDict, MultiDictProxy, CIMultiDict
+from aiohttp.web_reqrep import FileField
+
+__all__ = ['MultipartError', 'DataTooBig', 'MultipartParser']
+
+
+class MultipartError(ValueError):
+    """ Malformed multipart body."""
+
+
+class DataTooBig(MultipartError):
+    """ Non-file fields exceed DATA_UPLOAD_MAX_MEMORY_SIZE."""
+
+
+class MultipartParser(object):
+    """ Parses multipart/form-data body from aiohttp payload stream."""
+
+    # max length of part headers
+    max_header_size = 8192
+
+    def __init__(self, content, boundary, charset='utf-8',
+                 max_memory_size=None, max_data_size=None, temp_dir=None):
+        """
+        @param content: request payload stream
+        @param boundary: multipart boundary
+        @type boundary: bytes
+        @param charset: default charset of fields and file names
+        @param max_memory_size: size of file part in bytes to spool it
+            to disk
+        @param max_data_size: max total size of non-file fields, None for
+            unlimited
+        @param temp_dir: directory for spooled files
+        """
+        self.content = content
+        self.delimiter = b'--' + boundary
+        self.charset = charset
+        self.max_memory_size = max_memory_size or 0
+        self.max_data_size = max_data_size
+        self.temp_dir = temp_dir
+        self.buffer = bytearray()
+        self.data_size = 0
+
+    @asyncio.coroutine
+    def parse(self):
+        """ Reads and parses whole body.
+
+        @return: fields values and FileField instances for files
+        @rtype: MultiDictProxy
+        @raise MultipartError: malformed body
+        """
+        result = MultiDict()
+        # skip preamble
+        yield from self.read_until(self.delimiter)
+        while True:
+            # delimiter is followed by "--" for closing one, or by CRLF
+            while len(self.buffer) < 2:
+                yield from self.read_more()
+            if self.buffer[:2] == b'--':
+                break
+            if self.buffer[:2] != b'\r\n':
+                raise MultipartError("Invalid multipart delimiter")
+            headers = yield from self.read_headers()
+            disposition, params = cgi.parse_header(
+                headers.get('Content-Disposition', ''))
+            name = params.get('name')
+            if disposition != 'form-data' or name is None:
+                raise MultipartError("Invalid part Content-Disposition")
+            content_type, type_params = cgi.parse_header(
+                headers.get('Content-Type', 'text/plain'))
+            filename = params.get('filename')
+            if filename is None:
+                result.add(name, (yield from self.read_field(
+                    type_params.get('charset', self.charset))))
+            elif not filename:
+                # file input without file selected
+                yield from self.read_until(b'\r\n' + self.delimiter)
+            else:
+                f = yield from self.read_file()
+                result.add(name, FileField(name, filename, f, content_type))
+        # skip epilogue
+        self.buffer.clear()
+        while (yield from self.content.readany()):
+            pass
+        return MultiDictProxy(result)
+
+    @asyncio.coroutine
+    def read_more(self):
+        chunk = yield from self.content.readany()
+        if not chunk:
+            raise MultipartError("Unexpected end of multipart body")
+        self.buffer.extend(chunk)
+
+    @asyncio.coroutine
+    def read_until(self, delimiter, write=None):
+        """ Reads body up to delimiter and skips delimiter.
+
+        @param write: callback for data read, None to skip data
+        """
+        buffer = self.buffer
+        # tail which could contain beginning of delimiter
+        keep = len(delimiter) - 1
+        while True:
+            idx = buffer.find(delimiter)
+            if idx >= 0:
+                if write is not None:
+                    write(bytes(buffer[:idx]))
+                del buffer[:idx + len(delimiter)]
+                return
+            if len(buffer) > keep:
+                if write is not None:
+                    write(bytes(buffer[:-keep]))
+                del buffer[:-keep]
+            yield from self.read_more()
+
+    @asyncio.coroutine
+    def read_headers(self):
+        """ Reads part headers following delimiter.
+
+        @rtype: CIMultiDict
+        """
+        buffer = self.buffer
+        # CRLF after delimiter starts search, so part without headers
+        # is found too
+        while True:
+            idx = buffer.find(b'\r\n\r\n')
+            if idx >= 0:
+                break
+            if len(buffer) > self.max_header_size:
+                raise MultipartError("Part headers are too long")
+            yield from self.read_more()
+        lines = bytes(buffer[2:idx]).decode(self.charset, 'replace')
+        del buffer[:idx + 4]
+        headers = CIMultiDict()
+        for line in lines.split('\r\n') if lines else ():
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise MultipartError("Invalid part header %r" % line)
+            headers.add(name.strip(), value.strip())
+        return headers
+
+    @asyncio.coroutine
+    def read_field(self, charset):
+        """ Reads non-file field value.
+
+        @rtype: str
+        """
+        data = bytearray()
+
+        def write(chunk):
+            self.data_size += len(chunk)
+            if (self.max_data_size is not None and
+                    self.data_size > self.max_data_size):
+                raise DataTooBig("Form fields exceed %s bytes"
+                                 % self.max_data_size)
+            data.extend(chunk)
+
+        yield from self.read_until(b'\r\n' + self.delimiter, write)
+        try:
+            return data.decode(charset)
+        except (UnicodeDecodeError, LookupError) as e:
+            raise MultipartError(str(e))
+
+    @asyncio.coroutine
+    def read_file(self):
+        """ Reads file part to temporary file.
+
+        @return: file object positioned at start
+        @rtype: tempfile.SpooledTemporaryFile
+        """
+        f = tempfile.SpooledTemporaryFile(max_size=self.max_memory_size,
+                                          dir=self.temp_dir)
+        try:
+            yield from self.read_until(b'\r\n' + self.delimiter, f.write)
+        except BaseException:
+            f.close()
+            raise
+        f.seek(0)
+        return f
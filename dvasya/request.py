@@ -1,41 +1,296 @@
 # coding: utf-8
 
 # $Id: $
+import asyncio
+import cgi
+from collections.abc import MutableMapping
+import json
+from operator import attrgetter
 
-from aiohttp.web import Request
+from aiohttp.multidict import MultiDict
+from aiohttp.web import (Request, HTTPBadRequest,
+                         HTTPRequestEntityTooLarge)
+from aiohttp.web_reqrep import FileField
+from dvasya.conf import settings
+from dvasya.multipart import MultipartParser, MultipartError, DataTooBig
+
+
+def proxy_property(name):
+    """ Returns read-only property for aiohttp request attribute."""
+    return property(attrgetter('_request.' + name),
+                    doc="aiohttp.web.Request.%s" % name)
+
+
+def get_max_body_size(request: Request):
+    """ Returns request body size limit in bytes.
+
+    Limit is set to match info by url resolver from url pattern or
+    MAX_BODY_SIZE setting; None means unlimited.
+    """
+    return getattr(request.match_info, 'max_body_size',
+                   settings.MAX_BODY_SIZE)
+
+
+def get_peer_address(transport):
+    """ Returns remote address and port of connection.
+
+    Unix socket connections have empty address and None port.
+
+    @rtype: tuple
+    """
+    peername = transport.get_extra_info("peername")
+    if not isinstance(peername, tuple):
+        # unix socket connection
+        return peername or '', None
+    return peername[:2]
+
+
+class LimitedStreamReader(object):
+    """ Request payload stream wrapper which counts bytes read.
+
+    Raises HTTPRequestEntityTooLarge as soon as body exceeds the limit, so
+    chunked body without Content-Length is not read further.
+    """
+    __slots__ = ('content', 'max_size', 'size')
+
+    def __init__(self, content, max_size=None):
+        """
+        @param content: request payload stream
+        @param max_size: max body size in bytes, None for unlimited
+        """
+        self.content = content
+        self.max_size = max_size
+        self.size = 0
+
+    @asyncio.coroutine
+    def readany(self):
+        chunk = yield from self.content.readany()
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise HTTPRequestEntityTooLarge(
+                text="Request body exceeds %s bytes" % self.max_size)
+        return chunk
+
+
+@asyncio.coroutine
+def read_body(request: Request, max_size=None):
+    """ Reads whole request body with size limit.
+
+    Body is cached same way aiohttp.web.Request.read() does, so read(),
+    text(), json() and post() of aiohttp request don't read payload
+    stream again.
+
+    @param max_size: max body size in bytes, None for unlimited
+    @rtype: bytes
+    @raise HTTPRequestEntityTooLarge: body exceeds max_size
+    """
+    # noinspection PyProtectedMember
+    if request._read_bytes is None:
+        content = LimitedStreamReader(request.content, max_size)
+        body = bytearray()
+        while True:
+            chunk = yield from content.readany()
+            if not chunk:
+                break
+            body.extend(chunk)
+        request._read_bytes = bytes(body)
+    return request._read_bytes
+
+
+@asyncio.coroutine
+def parse_form(request: Request, max_body_size=None):
+    """ Parses form data from request body.
+
+    Same as aiohttp.web.Request.post(), but multipart/form-data body is
+    parsed incrementally, files are spooled to FILE_UPLOAD_TEMP_DIR, and
+    body size is limited by max_body_size.
+
+    @param max_body_size: max body size in bytes, None for unlimited
+    @return: fields values and FileField instances for files
+    @rtype: MultiDictProxy
+    @raise HTTPBadRequest: malformed multipart body
+    @raise HTTPRequestEntityTooLarge: body exceeds max_body_size or fields
+        exceed DATA_UPLOAD_MAX_MEMORY_SIZE
+    """
+    if request.method not in request.POST_METHODS:
+        return (yield from request.post())
+    if request.content_type != 'multipart/form-data':
+        if request.content_type in ('', 'application/x-www-form-urlencoded'):
+            yield from read_body(request, max_body_size)
+        return (yield from request.post())
+    _, params = cgi.parse_header(request.headers.get('Content-Type', ''))
+    boundary = params.get('boundary', '')
+    if not 0 < len(boundary) <= 70:
+        raise HTTPBadRequest(text="Invalid multipart boundary")
+    parser = MultipartParser(
+        LimitedStreamReader(request.content, max_body_size),
+        boundary.encode('latin-1', 'replace'),
+        charset=request.charset or 'utf-8',
+        max_memory_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+        max_data_size=settings.DATA_UPLOAD_MAX_MEMORY_SIZE,
+        temp_dir=settings.FILE_UPLOAD_TEMP_DIR)
+    try:
+        return (yield from parser.parse())
+    except DataTooBig as e:
+        raise HTTPRequestEntityTooLarge(text=str(e))
+    except MultipartError as e:
+        raise HTTPBadRequest(text=str(e))
+
+
+# marks META keys deleted by application
+_DELETED = object()
+
+
+class RequestMeta(MutableMapping):
+    """ Django-like request META.
+
+    Contains REMOTE_ADDR, REMOTE_PORT and request headers with names
+    converted to upper case and dashes replaced with underscores, so
+    "X-Real-IP" header value is META['X_REAL_IP']. Headers containing
+    underscores are skipped. Values are looked up in request headers
+    on access, list of keys is built on first iteration.
+
+    Values set or deleted by application (i.e. REMOTE_ADDR set by
+    middleware behind proxy) are kept in overrides dict, request headers
+    are not changed.
+    """
+    __slots__ = ('_request', '_keys', '_overrides')
+
+    remote_keys = ('REMOTE_ADDR', 'REMOTE_PORT')
+
+    def __init__(self, request: Request):
+        self._request = request
+        self._keys = None
+        self._overrides = None
+
+    def __getitem__(self, key):
+        if self._overrides is not None and key in self._overrides:
+            value = self._overrides[key]
+            if value is _DELETED:
+                raise KeyError(key)
+            return value
+        if key in self.remote_keys:
+            peername = get_peer_address(self._request.transport)
+            return peername[self.remote_keys.index(key)]
+        if not isinstance(key, str) or '-' in key or key != key.upper():
+            raise KeyError(key)
+        values = self._request.headers.getall(key.replace('_', '-'), ())
+        if not values:
+            raise KeyError(key)
+        # last value of repeated header wins
+        return values[-1]
+
+    def __setitem__(self, key, value):
+        if self._overrides is None:
+            self._overrides = {}
+        self._overrides[key] = value
+
+    def __delitem__(self, key):
+        # raises KeyError for missing key
+        self[key]
+        self[key] = _DELETED
+
+    def __iter__(self):
+        return iter(self._get_keys())
+
+    def __len__(self):
+        return len(self._get_keys())
+
+    def _get_keys(self):
+        if self._keys is None:
+            keys = list(self.remote_keys)
+            for k in self._request.headers:
+                if '_' in k:
+                    continue
+                key = k.upper().replace('-', '_')
+                if key not in keys:
+                    keys.append(key)
+            self._keys = keys
+        if not self._overrides:
+            return self._keys
+        overrides = self._overrides
+        keys = [k for k in self._keys if overrides.get(k) is not _DELETED]
+        keys.extend(k for k, v in overrides.items()
+                    if v is not _DELETED and k not in self._keys)
+        return keys
 
 
 class DvasyaRequestProxy(object):
+    """ Wrapper for aiohttp.web.Request with django-like attributes.
+
+    Other attributes are looked up in aiohttp request.
+    """
+    # __dict__ keeps arbitrary attributes, i.e. set by middlewares; it is
+    # not allocated until first such attribute is set.
+    __slots__ = ('_request', '_meta', '_post', 'POST', 'FILES', '__dict__')
+
+    method = proxy_property('method')
+    path = proxy_property('path')
+    path_qs = proxy_property('path_qs')
+    query_string = proxy_property('query_string')
+    GET = proxy_property('GET')
+    headers = proxy_property('headers')
+    match_info = proxy_property('match_info')
+    transport = proxy_property('transport')
+    COOKIES = proxy_property('cookies')
 
     def __init__(self, request: Request):
-        self.__request = request
+        self._request = request
+        self._meta = None
+        self._post = None
         self.POST = {}
         self.FILES = {}
-        self._meta = None
 
     def __getattr__(self, item):
-        try:
-            return getattr(self.__request, item)
-        except AttributeError:
-            return super().__getattribute__(item)
+        if item == '_request':
+            # not initialized yet, i.e. while copying
+            raise AttributeError(item)
+        return getattr(self._request, item)
 
     @property
     def META(self):
-        if self._meta:
-            return self._meta
-        transport = self.__request.transport
-        remote_addr, remote_port = transport.get_extra_info("peername")
-        self._meta = {
-            'REMOTE_ADDR': remote_addr,
-            "REMOTE_PORT": remote_port
-        }
-        for k, v in self.__request.headers.items():
-            if '_' in k:
-                continue
-            key = k.upper().replace('-', '_')
-            self._meta[key] = v
+        if self._meta is None:
+            self._meta = RequestMeta(self._request)
         return self._meta
 
-    @property
-    def COOKIES(self):
-        return self.__request.cookies
+    @asyncio.coroutine
+    def read(self):
+        """ Reads request body limited by max body size of matched route.
+
+        @rtype: bytes
+        @raise HTTPRequestEntityTooLarge: body is too large
+        """
+        return (yield from read_body(self._request,
+                                     get_max_body_size(self._request)))
+
+    @asyncio.coroutine
+    def text(self):
+        """ Reads request body and decodes it with request charset."""
+        yield from self.read()
+        return (yield from self._request.text())
+
+    @asyncio.coroutine
+    def json(self, *, loader=json.loads):
+        """ Reads request body and decodes it as JSON."""
+        yield from self.read()
+        return (yield from self._request.json(loader=loader))
+
+    @asyncio.coroutine
+    def post(self):
+        """ Parses form data from request body and fills POST and FILES.
+
+        @return: fields values and FileField instances for files, same as
+            aiohttp.web.Request.post() does
+        @rtype: MultiDictProxy
+        """
+        if self._post is None:
+            data = yield from parse_form(self._request,
+                                         get_max_body_size(self._request))
+            self.POST, self.FILES = MultiDict(), MultiDict()
+            for key, value in data.items():
+                if isinstance(value, FileField):
+                    self.FILES.add(key, value)
+                else:
+                    self.POST.add(key, value)
+            self._post = data
+        return self._post
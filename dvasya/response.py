@@ -38,23 +38,34 @@ class HttpResponseNotAllowed(Response):
         self.headers['ALLOW'] = ', '.join(permitted_methods)
 
 
+# shared response body for not found pages when not DEBUG
+NOT_FOUND_BODY = b'<h1>Not Found</h1>'
+
+
 class HttpResponseNotFound(HTTPNotFound):
     """ Not Found response class.
 
     If DEBUG, and url resolver was not able to find resource,
-    writes last visited urlconf dump.
+    writes last visited urlconf dump. Otherwise shared pre-encoded body is
+    used, and patterns are not touched at all.
     """
     status_code = 404
 
-    def __init__(self, *, path=None, patterns=None):
+    def __init__(self, *, path=None, patterns=(), prefix=None):
+        """
+        @param path: request path
+        @param patterns: last visited url patterns
+        @param prefix: regex of include() that patterns belong to
+        """
         if not settings.DEBUG:
-            content = ''
-        else:
-            content = (
-                "<h2>No match for path</h2>"
-                "<h4>{}</h4>"
-                "<h3>URLConf</h3>".format(path))
-            content += '<br/>'.join(str(p) for p in patterns)
+            super().__init__(body=NOT_FOUND_BODY, content_type="text/html")
+            return
+        prefix = prefix + ' ' if prefix else ''
+        content = (
+            "<h2>No match for path</h2>"
+            "<h4>{}</h4>"
+            "<h3>URLConf</h3>".format(path))
+        content += '<br/>'.join(prefix + str(p.regex) for p in patterns)
         super().__init__(text=content, content_type="text/html")
 
 
@@ -63,7 +74,8 @@ class HttpInternalError(HTTPInternalServerError):
         if not settings.DEBUG:
             content = ''
         else:
-            stack = traceback.format_exc()
+            stack = ''.join(traceback.format_exception(
+                type(exc), exc, exc.__traceback__))
             content = (
                 "<h2>Internal Server Error</h2>"
                 "<h4>{0}: {1}</h4>"
@@ -8,53 +8,285 @@
 # * daemonize
 # * master-worker multiprocess configuration
 # * pidfile, host and port options
+# * several TCP and unix socket listeners
+# * systemd socket activation (LISTEN_FDS)
 # * worker shutdown on SIGINT, SIGTERM or master death.
+# * graceful drain of open connections on SIGTERM
+# * application preloading with frozen heap shared by workers
+# * worker recycling after max requests or resident memory limit
+# * worker statistics and route timings reported over heartbeat pipe
+# * event loop lag monitor logging stacks of blocked workers
+# * adaptive number of workers
+# * worker CPU affinity pinning
+# * pluggable worker event loop policy
+# * worker restart backoff and crash loop detection
+# * per-worker SO_REUSEPORT listening sockets
+# * rolling reload of workers with new application code on SIGHUP
 #
 # inspired by aiohttp.examples.mpsrv.HttpServer
 # @see https://github.com/fafhrd91/aiohttp
 import os
+import random
 import signal
 import socket
+import stat
 import time
 import sys
 import atexit
 import asyncio
+import collections
+import json
+import struct
 
 import aiohttp.server
-from aiohttp import websocket, web
+from aiohttp import helpers, websocket, web
+from dvasya.conf import settings
 from dvasya.logging import getLogger
 from dvasya.middleware import load_middlewares
-from dvasya.urls import load_resolver
+from dvasya.stats import WorkerStats, LoopLagMonitor, Timings, timings
+from dvasya.urls import load_resolver, UrlConfError
+from dvasya.utils import freeze_heap, get_memory_usage, get_numa_nodes
+from dvasya.utils import set_event_loop_policy, unfreeze_heap
+
+
+# first file descriptor passed by systemd socket activation
+LISTEN_FDS_START = 3
+
+# socket.SO_DOMAIN is available since python 3.6; value is for linux
+SO_DOMAIN = getattr(socket, 'SO_DOMAIN', 39)
+
+
+def parse_address(address):
+    """ Parses listening address.
+
+    @param address: "unix:/path/to/socket", "host:port" or "port"; IPv6
+        host could be enclosed in brackets.
+    @return: unix socket path or (host, port) tuple
+    @raise ValueError: invalid port
+    """
+    if address.startswith('unix:'):
+        return os.path.abspath(address[len('unix:'):])
+    host, _, port = address.rpartition(':')
+    return host.strip('[]'), int(port)
+
+
+def bind_socket(address, reuse_port=False, backlog=1024):
+    """ Opens listening socket.
+
+    @param address: unix socket path or (host, port) tuple
+    @param reuse_port: set SO_REUSEPORT option, so several processes
+        could listen same address and kernel balances connections between
+        them.
+    @param backlog: length of pending connections queue
+    @raise OSError: SO_REUSEPORT is not supported
+    """
+    if isinstance(address, str):
+        family = socket.AF_UNIX
+        remove_unix_socket(address)
+    elif ':' in address[0]:
+        family = socket.AF_INET6
+    else:
+        family = socket.AF_INET
+    sock = socket.socket(family)
+    try:
+        if family != socket.AF_UNIX:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+    except OSError:
+        sock.close()
+        raise
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def remove_unix_socket(path):
+    """ Removes unix socket file left by previous server run."""
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def reuse_port_supported(address):
+    """ Checks whether SO_REUSEPORT sockets could be bound to address."""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        return False
+    try:
+        probe = bind_socket(address, reuse_port=True)
+    except OSError:
+        return False
+    probe.close()
+    return True
+
+
+def inherited_sockets():
+    """ Returns listening sockets passed by systemd socket activation.
+
+    Sockets are kept open by systemd, so connections queued while server
+    restarts are not lost.
+
+    @see: sd_listen_fds(3)
+    @rtype: list
+    """
+    if os.environ.get('LISTEN_PID') != str(os.getpid()):
+        return []
+    count = int(os.environ.get('LISTEN_FDS', 0))
+    # sockets are not passed to processes started by application
+    for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+        os.environ.pop(name, None)
+    sockets = []
+    for fd in range(LISTEN_FDS_START, LISTEN_FDS_START + count):
+        probe = socket.socket(fileno=fd)
+        family = probe.getsockopt(socket.SOL_SOCKET, SO_DOMAIN)
+        probe.detach()
+        sock = socket.socket(family, socket.SOCK_STREAM, fileno=fd)
+        sock.setblocking(False)
+        sockets.append(sock)
+    return sockets
+
+
+def describe_exit_status(status):
+    """ Returns human-readable process exit status from os.waitpid()."""
+    if os.WIFSIGNALED(status):
+        return "signal %s" % os.WTERMSIG(status)
+    return "exit code %s" % os.WEXITSTATUS(status)
 
 
 class ChildProcess:
     """ Worker process for http server."""
     logger = getLogger('dvasya.worker')
 
-    middlewares = load_middlewares()
+    # seconds for just accepted connections to send request before idle
+    # connections are closed while draining
+    drain_delay = 0.5
+
+    # requests being handled, finished, aborted while handling and failed
+    in_flight = 0
+    served = 0
+    aborted = 0
+    errors = 0
+
+    lag_monitor = None
 
-    resolver_class = load_resolver()
+    draining = False
+    recycle_requested = False
 
-    def __init__(self, up_read, down_write, args, sock):
+    # set by load_application()
+    middlewares = None
+    resolver_class = None
+
+    def __init__(self, up_read, down_write, args, listeners):
         self.up_read = up_read
         self.down_write = down_write
         self.args = args
-        self.sock = sock
+        self.listeners = listeners
+        self.handlers = {}
+        self.servers = []
+        self.writer = None
+        # process time and wall time of previous stats report
+        self.cpu_time = time.process_time()
+        self.report_time = time.monotonic()
+        # requests before recycling, jitter prevents simultaneous restarts
+        self.max_requests = args.max_requests
+        if self.max_requests:
+            self.max_requests += random.randint(0, args.max_requests_jitter)
+
+    # unix socket connections have no peer address
+    unix_access_log_format = helpers.AccessLogger.LOG_FORMAT.replace(
+        '%a', '-')
+
+    @classmethod
+    def load_application(cls):
+        """ Imports middlewares and urlconf and compiles url patterns.
+
+        With --preload supervisor loads application before forking workers,
+        otherwise every worker loads it after fork, so reload picks up new
+        code.
+
+        @raise UrlConfError: urlconf is invalid
+        """
+        if cls.middlewares is None:
+            cls.middlewares = load_middlewares()
+        if cls.resolver_class is None:
+            cls.resolver_class = load_resolver()
+        cls.resolver_class.autodiscover()
 
     @property
-    def protocol_factory(self):
-        app = web.Application(router=self.resolver_class(),
-                              loop=self.loop,
-                              middlewares=self.middlewares,
-                              logger=self.logger)
-        return app.make_handler(access_log=getLogger('dvasya.request'))
+    def app(self):
+        self.load_application()
+        middlewares = [self.track_requests] + list(self.middlewares)
+        return web.Application(router=self.resolver_class.autodiscover(),
+                               loop=self.loop,
+                               middlewares=middlewares,
+                               logger=self.logger)
+
+    def protocol_factory(self, app, family):
+        """ Returns connection handler factory for socket family.
+
+        Listeners of same family share handler.
+        """
+        handler = self.handlers.get(family)
+        if handler is None:
+            kwargs = {}
+            if family == socket.AF_UNIX:
+                kwargs['access_log_format'] = self.unix_access_log_format
+            handler = self.handlers[family] = app.make_handler(
+                access_log=getLogger('dvasya.request'), **kwargs)
+        return handler
+
+    @property
+    def accepted(self):
+        """ Number of connections accepted by worker."""
+        return sum(h.num_connections for h in self.handlers.values())
+
+    # noinspection PyUnusedLocal
+    @asyncio.coroutine
+    def track_requests(self, app, handler):
+        """ Middleware factory counting in-flight and finished requests."""
+
+        @asyncio.coroutine
+        def tracked(request):
+            self.in_flight += 1
+            try:
+                response = yield from handler(request)
+            except asyncio.CancelledError:
+                # connection closed by drain timeout or client
+                self.aborted += 1
+                raise
+            except Exception:
+                self.served += 1
+                self.errors += 1
+                raise
+            else:
+                self.served += 1
+                if response.status >= 500:
+                    self.errors += 1
+                if self.served == self.max_requests:
+                    self.request_recycle(
+                        '{} requests served'.format(self.served))
+                return response
+            finally:
+                self.in_flight -= 1
+        return tracked
 
     def before_loop(self):
         # heartbeat
         asyncio.async(self.heartbeat())
+        if settings.INSTRUMENTATION:
+            asyncio.async(self.report_timings())
+        if settings.LOOP_LAG_INTERVAL:
+            self.lag_monitor = LoopLagMonitor(self.loop,
+                                              settings.LOOP_LAG_INTERVAL,
+                                              settings.LOOP_LAG_THRESHOLD)
+            self.lag_monitor.start()
 
     def start(self):
         # start server
+        set_event_loop_policy(settings.EVENT_LOOP_POLICY, self.logger)
         self.loop = loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
@@ -63,18 +295,40 @@ class ChildProcess:
             os._exit(0)
 
         loop.add_signal_handler(signal.SIGINT, stop)
+        loop.add_signal_handler(
+            signal.SIGTERM, lambda: asyncio.async(self.shutdown()))
 
-        f = loop.create_server(self.protocol_factory, sock=self.sock)
-        srv = loop.run_until_complete(f)
-        x = srv.sockets[0]
-        self.logger.info('Starting srv worker process {} on {}'.format(
-            os.getpid(), x.getsockname()))
-
+        try:
+            app = self.app
+        except Exception:
+            self.logger.exception(
+                'Worker {} failed to load application'.format(os.getpid()))
+            os._exit(1)
+        loop.run_until_complete(self.create_servers(app))
         self.before_loop()
 
         asyncio.get_event_loop().run_forever()
         os._exit(0)
 
+    @asyncio.coroutine
+    def create_servers(self, app):
+        """ Starts serving app on all listeners.
+
+        Listeners without socket are in SO_REUSEPORT mode, and worker binds
+        its own socket for them.
+        """
+        for address, sock in self.listeners:
+            if sock is None:
+                sock = bind_socket(address, reuse_port=True,
+                                   backlog=self.args.backlog)
+            handler = self.protocol_factory(app, sock.family)
+            # create_server() calls listen() again
+            server = yield from self.loop.create_server(
+                handler, sock=sock, backlog=self.args.backlog)
+            self.servers.append(server)
+            self.logger.info('Starting srv worker process {} on {}'.format(
+                os.getpid(), sock.getsockname()))
+
     @asyncio.coroutine
     def heartbeat(self):
         # setup pipes
@@ -84,7 +338,9 @@ class ChildProcess:
             aiohttp.StreamProtocol, os.fdopen(self.down_write, 'wb'))
 
         reader = read_proto.reader.set_parser(websocket.WebSocketParser)
-        writer = websocket.WebSocketWriter(write_transport)
+        writer = self.writer = websocket.WebSocketWriter(write_transport)
+        # server is listening, tell supervisor worker is ready
+        writer.send('ready')
 
         while True:
             try:
@@ -96,13 +352,107 @@ class ChildProcess:
                 break
 
             if msg.tp == websocket.MSG_PING:
-                writer.pong()
+                stats = self.get_stats()
+                writer.pong(stats.pack())
+                self.check_memory(stats.rss)
             elif msg.tp == websocket.MSG_CLOSE:
+                yield from self.shutdown()
                 break
 
         read_transport.close()
         write_transport.close()
 
+    @asyncio.coroutine
+    def report_timings(self):
+        """ Periodically sends route timings histograms to supervisor."""
+        while True:
+            yield from asyncio.sleep(self.args.stats_interval, loop=self.loop)
+            if self.writer is not None and timings.histograms:
+                self.writer.send('timings %s' % json.dumps(timings.dump()))
+
+    def get_stats(self):
+        """ Collects worker counters.
+
+        @rtype: WorkerStats
+        """
+        usage = get_memory_usage(os.getpid())
+        rss = sum(usage) if usage is not None else 0
+        # max loop lag since previous report
+        lag = 0.0
+        if self.lag_monitor is not None:
+            lag = self.lag_monitor.take_max_lag()
+        # event loop thread is busy while it uses CPU
+        cpu_time, now = time.process_time(), time.monotonic()
+        busy = (cpu_time - self.cpu_time) / max(now - self.report_time, 1e-6)
+        self.cpu_time, self.report_time = cpu_time, now
+        return WorkerStats(self.served, self.in_flight, lag, rss,
+                           self.errors, self.accepted, busy)
+
+    def check_memory(self, rss):
+        """ Requests recycling if resident memory exceeds args.max_rss.
+
+        @param rss: resident memory in bytes
+        """
+        if not self.args.max_rss or not rss:
+            return
+        rss /= 2 ** 20
+        if rss > self.args.max_rss:
+            self.request_recycle('resident memory {:.1f} MB'.format(rss))
+
+    def request_recycle(self, reason):
+        """ Asks supervisor to gracefully replace worker."""
+        if self.recycle_requested or self.draining or self.writer is None:
+            return
+        self.recycle_requested = True
+        self.writer.send('recycle %s' % reason)
+
+    @asyncio.coroutine
+    def shutdown(self):
+        """ Drains connections, reports drain results and stops worker."""
+        if self.draining:
+            return
+        self.draining = True
+        drained, aborted = yield from self.drain()
+        self.logger.info(
+            'Worker {} drained {} requests, {} aborted'.format(
+                os.getpid(), drained, aborted))
+        if self.lag_monitor is not None:
+            self.lag_monitor.stop()
+            summary = self.lag_monitor.histogram.summary()
+            self.logger.info(
+                'Worker {} loop lag: mean {:.1f}ms, p99 {:.1f}ms, '
+                'max {:.1f}ms'.format(
+                    os.getpid(), summary['mean'] * 1000,
+                    summary['p99'] * 1000, summary['max'] * 1000))
+        if self.writer is not None:
+            self.writer.send('drained %d %d' % (drained, aborted))
+        self.loop.stop()
+
+    @asyncio.coroutine
+    def drain(self):
+        """ Stops accepting connections and finishes open ones.
+
+        Connections still open after graceful timeout are closed.
+
+        @return: number of requests finished and aborted while draining
+        @rtype: tuple
+        """
+        self.logger.info('Worker {} is draining {} requests'.format(
+            os.getpid(), self.in_flight))
+        served, aborted = self.served, self.aborted
+        # stop accepting first: closing server right away breaks connections
+        # accepted in current loop iteration but not attached to server yet
+        for server in self.servers:
+            for sock in server.sockets:
+                self.loop.remove_reader(sock.fileno())
+        yield from asyncio.sleep(self.drain_delay, loop=self.loop)
+        for server in self.servers:
+            server.close()
+        yield from asyncio.gather(
+            *[h.finish_connections(self.args.graceful_timeout)
+              for h in self.handlers.values()], loop=self.loop)
+        return self.served - served, self.aborted - aborted
+
 
 class Worker:
     """ Worker controller for superviser.
@@ -111,14 +461,41 @@ class Worker:
     """
 
     _started = False
+    # last stats reported by child process with pong
+    stats = WorkerStats(0, 0, 0.0, 0, 0, 0, 0.0)
+    # last route timings histograms reported by child process
+    timings = None
+    # worker is being stopped and must not be restarted
+    retiring = False
+    # new worker is being started to replace this one
+    replacing = False
+    pid = None
+    # resolved with pid when child process is ready to accept connections
+    ready = None
+    connect_task = chat_task = heartbeat_task = None
+    rtransport = wtransport = writer = None
+    # seconds to wait for drained child exit after graceful timeout
+    stop_margin = 5
     child_kill_signal = signal.SIGKILL
     child_process_class = ChildProcess
     logger = getLogger('dvasya.worker')
 
-    def __init__(self, loop, args, sock):
+    def __init__(self, loop, args, listeners, on_recycle=None, slot=0,
+                 cpus=None):
+        """
+        @param listeners: list of (address, socket) tuples, socket is None
+            if child process binds its own SO_REUSEPORT socket
+        @param on_recycle: callback called with worker when child process
+            asks for replacement
+        @param slot: worker number, kept when child process is restarted
+        @param cpus: set of CPUs child process is pinned to
+        """
         self.loop = loop
         self.args = args
-        self.sock = sock
+        self.listeners = listeners
+        self.on_recycle = on_recycle
+        self.slot = slot
+        self.cpus = cpus
         self.start()
 
     def start(self):
@@ -127,14 +504,29 @@ class Worker:
 
         up_read, up_write = os.pipe()
         down_read, down_write = os.pipe()
-        args, sock = self.args, self.sock
+        args, listeners = self.args, self.listeners
 
+        if args.preload:
+            # objects created since previous fork are frozen too
+            freeze_heap()
         pid = os.fork()
         if pid:
             # parent
+            if args.preload:
+                # heap is frozen for child process only, otherwise
+                # supervisor garbage is never collected
+                unfreeze_heap()
             os.close(up_read)
             os.close(down_write)
-            asyncio.async(self.connect(pid, up_write, down_read))
+            self.pid = pid
+            self.started_at = time.monotonic()
+            if self.ready is None or self.ready.done():
+                # child restarted before it got ready keeps the future, so
+                # replace_workers() waits for the new child process
+                self.ready = asyncio.Future(loop=self.loop)
+            self.exited = asyncio.Future(loop=self.loop)
+            self.connect_task = asyncio.async(
+                self.connect(pid, up_write, down_read))
         else:
             # child
             os.close(up_write)
@@ -142,9 +534,13 @@ class Worker:
 
             # cleanup after fork
             asyncio.set_event_loop(None)
+            random.seed()
+            if self.cpus:
+                os.sched_setaffinity(0, self.cpus)
 
             # setup process
-            process = self.child_process_class(up_read, down_write, args, sock)
+            process = self.child_process_class(up_read, down_write, args,
+                                               listeners)
             process.start()
 
     @asyncio.coroutine
@@ -161,9 +557,9 @@ class Worker:
                     'Worker process {} became unresponsive'.format(
                         self.pid))
                 if force_kill:
-                    self.logger.info("Restarting process: {}".format(self.pid))
+                    # supervisor restarts killed process
+                    self.logger.info("Killing process: {}".format(self.pid))
                     self.kill()
-                    self.start()
                 return
 
     @asyncio.coroutine
@@ -172,15 +568,53 @@ class Worker:
             try:
                 msg = yield from reader.read()
             except aiohttp.EofStream:
+                if self.retiring:
+                    return
+                # supervisor restarts killed process
                 self.logger.info(
-                    'Restart unresponsive worker process: {}'.format(
+                    'Kill unresponsive worker process: {}'.format(
                         self.pid))
                 self.kill()
-                self.start()
                 return
 
             if msg.tp == websocket.MSG_PONG:
                 self.ping = time.monotonic()
+                if msg.data:
+                    try:
+                        self.stats = WorkerStats.unpack(msg.data)
+                    except struct.error:
+                        self.logger.warning(
+                            'Invalid stats frame from worker process '
+                            '{}'.format(self.pid))
+            elif msg.tp == websocket.MSG_TEXT:
+                self.handle_message(msg.data)
+
+    def handle_message(self, data):
+        """ Handles text message from child process."""
+        if data == 'ready':
+            if not self.ready.done():
+                self.ready.set_result(self.pid)
+        elif data.startswith('drained '):
+            drained, aborted = map(int, data.split()[1:])
+            self.logger.info(
+                'Worker process {} stopped: {} requests drained, '
+                '{} aborted'.format(self.pid, drained, aborted))
+        elif data.startswith('timings '):
+            try:
+                state = json.loads(data[len('timings '):])
+                # check state could be merged
+                Timings().merge(state)
+            except (ValueError, TypeError, KeyError, AttributeError):
+                self.logger.warning(
+                    'Invalid timings from worker process {}'.format(
+                        self.pid))
+            else:
+                self.timings = state
+        elif data.startswith('recycle '):
+            self.logger.info('Worker process {} asks for recycling: {}'.format(
+                self.pid, data[len('recycle '):]))
+            if self.on_recycle is not None and not self.retiring:
+                self.on_recycle(self)
 
     @asyncio.coroutine
     def connect(self, pid, up_write, down_read):
@@ -197,44 +631,217 @@ class Worker:
         # store info
         self.pid = pid
         self.ping = time.monotonic()
+        self.stats = Worker.stats
         self.rtransport = read_transport
         self.wtransport = write_transport
+        self.writer = writer
         self.chat_task = asyncio.Task(self.chat(reader))
         self.heartbeat_task = asyncio.Task(self.heartbeat(writer))
 
-    def kill(self):
+    def close(self):
+        """ Closes communication with child process."""
         self._started = False
-        self.chat_task.cancel()
-        self.heartbeat_task.cancel()
-        self.rtransport.close()
-        self.wtransport.close()
-        os.kill(self.pid, self.child_kill_signal)
+        for task in (self.connect_task, self.chat_task, self.heartbeat_task):
+            if task is not None:
+                task.cancel()
+        for transport in (self.rtransport, self.wtransport):
+            if transport is not None:
+                transport.close()
+        self.connect_task = self.chat_task = self.heartbeat_task = None
+        self.rtransport = self.wtransport = self.writer = None
+
+    def kill(self):
+        self.close()
+        try:
+            os.kill(self.pid, self.child_kill_signal)
+        except ProcessLookupError:
+            pass
+
+    @asyncio.coroutine
+    def stop(self, timeout):
+        """ Gracefully stops child process.
+
+        Child stops accepting connections and finishes open ones; if it
+        doesn't exit in time, it is killed. Child process which is not
+        connected yet is killed at once.
+
+        @param timeout: graceful timeout in seconds
+        """
+        self.retiring = True
+        if self.exited.done():
+            # child process exited, i.e. it waits for restart
+            return
+        if self.writer is None:
+            self.logger.info(
+                'Worker process {} is not connected yet, killing'.format(
+                    self.pid))
+            self.kill()
+        else:
+            self.heartbeat_task.cancel()
+            self.writer.close()
+        try:
+            yield from asyncio.wait_for(asyncio.shield(self.exited),
+                                        timeout + self.stop_margin,
+                                        loop=self.loop)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                'Worker process {} did not exit in time, killing'.format(
+                    self.pid))
+            self.kill()
+            yield from self.exited
+        self.close()
+
+
+class Autoscaler:
+    """ Decides when worker pool is scaled by workers load samples.
+
+    Worker is added when average CPU busy share or requests in flight
+    stays high and idle worker is removed when workers stay idle, within
+    min_workers and max_workers. Scaling requires `samples` consecutive
+    samples and `cooldown` seconds since previous scaling, so pool size
+    doesn't flap.
+    """
+
+    # average worker load thresholds
+    up_busy = 0.7
+    up_in_flight = 8
+    down_busy = 0.2
+    # number of consecutive samples to trigger scaling
+    samples = 3
+    # seconds between scaling actions
+    cooldown = 30
+
+    # average load of last sample
+    busy = 0.0
+    in_flight = 0.0
+
+    def __init__(self, min_workers, max_workers, now):
+        """
+        @param now: time.monotonic() value, cooldown starts from it
+        """
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max_workers
+        self.last_scaled = now
+        self.high = self.low = 0
+
+    def reset(self):
+        """ Forgets consecutive samples, i.e. while workers are reloaded."""
+        self.high = self.low = 0
+
+    def sample(self, workers, now):
+        """ Registers workers load and decides whether to scale.
+
+        @param workers: running workers which are not being stopped
+        @param now: time.monotonic() value
+        @return: (1, None) to add worker, (-1, worker) to stop idle worker,
+            (0, None) to keep pool as is
+        @rtype: tuple
+        """
+        self.busy = sum(w.stats.busy for w in workers) / len(workers)
+        self.in_flight = sum(w.stats.in_flight for w in workers) / len(workers)
+        if self.busy > self.up_busy or self.in_flight > self.up_in_flight:
+            self.high, self.low = self.high + 1, 0
+        elif self.busy < self.down_busy and self.in_flight < 1:
+            self.high, self.low = 0, self.low + 1
+        else:
+            self.reset()
+        if now - self.last_scaled < self.cooldown:
+            return 0, None
+        if self.high >= self.samples and len(workers) < self.max_workers:
+            decision = 1, None
+        elif self.low >= self.samples and len(workers) > self.min_workers:
+            # workers being recycled are already replaced
+            idle = min((w for w in workers if not w.replacing),
+                       key=lambda w: w.stats.in_flight, default=None)
+            if idle is None:
+                return 0, None
+            decision = -1, idle
+        else:
+            return 0, None
+        self.reset()
+        self.last_scaled = now
+        return decision
 
 
 class Supervisor:
     """ Master process for http server."""
     worker_class = Worker
+    autoscaler_class = Autoscaler
     logger = getLogger('dvasya.supervisor')
     _terminating = False
+    _reloading = False
+
+    # restart backoff: first delay and max delay in seconds; backoff is
+    # reset for workers that lived longer than stable_uptime seconds
+    restart_delay = 0.5
+    max_restart_delay = 30
+    stable_uptime = 60
+
+    # exit code of supervisor process
+    exit_code = 0
 
     def __init__(self, args):
         self.args = args
-        self.workers = []
+        # workers by pid
+        self.workers = {}
+        self.cpu_sets = None
+        self.listeners = []
+        # unix socket files to remove on exit
+        self.unix_sockets = []
+        # consecutive quick restarts by worker slot
+        self.failures = collections.Counter()
+        # pending delayed restarts by worker; replacement shares slot with
+        # replaced worker, so both could be waiting for restart
+        self.pending_restarts = {}
+        # recent restart times for crash loop detection
+        self.restarts = collections.deque()
         self.pidfile = os.path.join(os.getcwd(), self.args.pidfile)
 
-    def open_socket(self):
-        # bind socket
-        sock = self.sock = socket.socket()
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind((self.args.host, self.args.port))
-        sock.listen(1024)
-        sock.setblocking(False)
-        return sock
+    def open_sockets(self):
+        """ Binds listening sockets shared by workers.
+
+        Sockets passed by systemd socket activation are used as is,
+        otherwise every --bind address (or --host and --port) is bound.
+        In SO_REUSEPORT mode TCP socket is not opened, and each worker binds
+        its own one. If SO_REUSEPORT is not available, shared socket is used.
+
+        @return: list of (address, socket or None) tuples
+        @rtype: list
+        """
+        sockets = inherited_sockets()
+        if sockets:
+            self.logger.info("using %s sockets passed by LISTEN_FDS"
+                             % len(sockets))
+            self.listeners = [(s.getsockname(), s) for s in sockets]
+            return self.listeners
+        addresses = [parse_address(a) for a in self.args.bind or ()]
+        if not addresses:
+            addresses = [(self.args.host, self.args.port)]
+        self.listeners = []
+        for address in addresses:
+            if isinstance(address, str):
+                self.unix_sockets.append(address)
+            elif getattr(self.args, 'reuse_port', False):
+                if reuse_port_supported(address):
+                    self.logger.info("workers listen %s with SO_REUSEPORT"
+                                     % (address,))
+                    self.listeners.append((address, None))
+                    continue
+                self.logger.warning(
+                    "SO_REUSEPORT is not supported, using shared socket")
+            sock = bind_socket(address, backlog=self.args.backlog)
+            self.listeners.append((address, sock))
+        return self.listeners
+
+    def remove_unix_sockets(self):
+        for path in self.unix_sockets:
+            remove_unix_socket(path)
 
     def add_signal_handlers(self):
         self.loop.add_signal_handler(signal.SIGINT, self.stop)
-        self.loop.add_signal_handler(signal.SIGTERM, self.stop)
+        self.loop.add_signal_handler(signal.SIGTERM, self.terminate)
         self.loop.add_signal_handler(signal.SIGCHLD, self.waitpid)
+        self.loop.add_signal_handler(signal.SIGHUP, self.reload)
 
     @asyncio.coroutine
     def wait_for_children(self):
@@ -246,23 +853,382 @@ class Supervisor:
     def stop(self):
         self.logger.info("stopping workers...")
         self._terminating = True
-        for worker in self.workers:
+        self.cancel_restarts()
+        for worker in list(self.workers.values()):
             self.logger.debug("kill %s " % worker.pid)
             worker.kill()
         asyncio.Task(self.wait_for_children())
 
+    def terminate(self):
+        """ Gracefully stops workers; kills them on repeated signal."""
+        if self._terminating:
+            self.stop()
+            return
+        self._terminating = True
+        self.cancel_restarts()
+        asyncio.async(self.graceful_stop(), loop=self.loop)
+
+    @asyncio.coroutine
+    def graceful_stop(self):
+        """ Stops workers after they finish open connections.
+
+        Workers not exited in args.graceful_timeout are killed.
+        """
+        self.logger.info("gracefully stopping workers...")
+        timeout = self.args.graceful_timeout
+        yield from asyncio.gather(
+            *[w.stop(timeout) for w in self.workers.values()
+              if not w.retiring],
+            loop=self.loop)
+        yield from self.wait_for_children()
+
+    @asyncio.coroutine
+    def report_workers(self):
+        """ Periodically logs workers stats and memory.
+
+        Stats are also written to args.stats_file as JSON.
+        """
+        while True:
+            yield from asyncio.sleep(self.args.stats_interval, loop=self.loop)
+            stats = self.get_stats()
+            self.logger.info("workers stats: %s" % ' '.join(
+                '%s:%s' % (pid, self.format_stats(s))
+                for pid, s in sorted(stats['workers'].items())))
+            self.logger.info("cluster stats: %s" %
+                             self.format_stats(stats['total']))
+            for route, stages in sorted(stats['routes'].items()):
+                self.logger.info("route %s timings: %s" % (
+                    route, ' '.join(
+                        '%s:%s' % (stage, self.format_timings(summary))
+                        for stage, summary in sorted(stages.items()))))
+            self.report_memory()
+            if self.args.stats_file:
+                self.write_stats(stats)
+
+    def get_stats(self):
+        """ Returns cluster-wide view of workers stats.
+
+        @return: stats by worker pid, total and route timings summaries
+            of all workers
+        @rtype: dict
+        """
+        workers = {pid: w.stats for pid, w in self.workers.items()}
+        routes = Timings()
+        for worker in self.workers.values():
+            if worker.timings:
+                routes.merge(worker.timings)
+        return {
+            'time': time.time(),
+            'workers': workers,
+            'total': WorkerStats.aggregate(list(workers.values())),
+            'routes': routes.snapshot(),
+        }
+
+    @staticmethod
+    def format_stats(stats):
+        return ('served=%s in_flight=%s lag=%.1fms rss=%.1fMB errors=%s '
+                'accepted=%s busy=%.0f%%' % (
+                    stats.served, stats.in_flight, stats.loop_lag * 1000,
+                    stats.rss / 2 ** 20, stats.errors, stats.accepted,
+                    stats.busy * 100))
+
+    @staticmethod
+    def format_timings(summary):
+        return 'count=%s mean=%.1fms p50=%.1fms p99=%.1fms max=%.1fms' % (
+            summary['count'], summary['mean'] * 1000, summary['p50'] * 1000,
+            summary['p99'] * 1000, summary['max'] * 1000)
+
+    def write_stats(self, stats):
+        """ Atomically writes stats to args.stats_file as JSON."""
+        data = {
+            'time': stats['time'],
+            'workers': {str(pid): s._asdict()
+                        for pid, s in stats['workers'].items()},
+            'total': stats['total']._asdict(),
+            'routes': stats['routes'],
+        }
+        path = self.args.stats_file
+        tmp = '%s.%s.tmp' % (path, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            self.logger.error("Can't write stats file: %s" % e)
+
+    def report_memory(self):
+        """ Logs unique and shared resident memory of workers."""
+        usage = []
+        for worker in self.workers.values():
+            memory = get_memory_usage(worker.pid)
+            if memory is None:
+                return
+            usage.append('%s:%.1f/%.1f' % (
+                worker.pid, memory[0] / 2 ** 20, memory[1] / 2 ** 20))
+        self.logger.info("workers memory, unique/shared MB: %s" %
+                         ' '.join(usage))
+
+    def preload(self):
+        """ Prepares loaded application to be shared with workers.
+
+        Urlconf, views and middlewares are already loaded by
+        load_application(); heap is frozen so garbage collector in workers
+        doesn't touch copy-on-write pages.
+        """
+        frozen = freeze_heap()
+        if frozen is None:
+            self.logger.warning(
+                "gc.freeze() is not available, heap is not frozen")
+        else:
+            self.logger.info("application preloaded, %s objects frozen" %
+                             frozen)
+
+    def reload(self):
+        """ Replaces all workers without dropping connections."""
+        if self._reloading or self._terminating:
+            self.logger.warning("reload is already in progress, skipping")
+            return
+        if self.args.preload:
+            self.logger.warning("application is preloaded, workers are "
+                                "reloaded without code changes")
+        elif not self.load_application():
+            self.logger.error("application is not loaded, reload aborted")
+            return
+        asyncio.async(self.rolling_reload(), loop=self.loop)
+
+    @asyncio.coroutine
+    def rolling_reload(self):
+        """ Replaces workers by batches of args.reload_batch workers.
+
+        New workers are started first; old ones are gracefully stopped after
+        new are ready to accept connections.
+        """
+        self.logger.info("reloading workers...")
+        self._reloading = True
+        batch = max(1, self.args.reload_batch)
+        pending = list(self.workers.values())
+        try:
+            while True:
+                # workers recycled, scaled down or exited since reload
+                # started are not replaced
+                pending = [w for w in pending
+                           if self.workers.get(w.pid) is w and
+                           not w.retiring and not w.replacing]
+                if not pending:
+                    break
+                retiring, pending = pending[:batch], pending[batch:]
+                replaced = yield from self.replace_workers(retiring)
+                if not replaced:
+                    self.logger.error("reload aborted")
+                    return
+            self.logger.info("reload finished")
+        finally:
+            self._reloading = False
+
+    def recycle(self, worker):
+        """ Schedules graceful replacement of a worker."""
+        asyncio.async(self.recycle_worker(worker), loop=self.loop)
+
+    @asyncio.coroutine
+    def recycle_worker(self, worker):
+        """ Replaces worker; at most args.recycle_batch at once."""
+        with (yield from self.recycle_semaphore):
+            if (self._terminating or worker.retiring or worker.replacing or
+                    self.workers.get(worker.pid) is not worker):
+                return
+            yield from self.replace_workers([worker])
+
+    @asyncio.coroutine
+    def autoscale(self):
+        """ Adjusts number of workers to their load.
+
+        Load is sampled on every heartbeat, scaling is decided by
+        autoscaler_class within args.min_workers and args.max_workers.
+        """
+        interval = self.args.heartbeat or 15
+        autoscaler = self.autoscaler_class(
+            self.args.min_workers, self.args.max_workers, time.monotonic())
+        while True:
+            yield from asyncio.sleep(interval, loop=self.loop)
+            workers = [w for w in self.workers.values() if not w.retiring]
+            if self._reloading or self._terminating or not workers:
+                autoscaler.reset()
+                continue
+            delta, idle = autoscaler.sample(workers, time.monotonic())
+            if not delta:
+                continue
+            self.logger.info(
+                "scaling %s to %s workers (busy %.0f%%, in flight %.1f)" % (
+                    'up' if delta > 0 else 'down', len(workers) + delta,
+                    autoscaler.busy * 100, autoscaler.in_flight))
+            if delta > 0:
+                self.spawn_worker()
+            else:
+                asyncio.async(idle.stop(self.args.graceful_timeout),
+                              loop=self.loop)
+
+    def spawn_worker(self, slot=None):
+        """ Starts new worker process.
+
+        @param slot: worker slot, lowest free one by default
+        @rtype: Worker
+        """
+        if slot is None:
+            used = {w.slot for w in self.workers.values()}
+            used.update(w.slot for w in self.pending_restarts)
+            slot = next(s for s in range(len(used) + 1) if s not in used)
+        cpus = None
+        if self.cpu_sets:
+            cpus = self.cpu_sets[slot % len(self.cpu_sets)]
+        worker = self.worker_class(self.loop, self.args, self.listeners,
+                                   on_recycle=self.recycle, slot=slot,
+                                   cpus=cpus)
+        self.workers[worker.pid] = worker
+        return worker
+
+    def get_cpu_sets(self):
+        """ Returns CPU sets workers are pinned to by slot.
+
+        "auto" mode pins each worker to its own CPU, "numa" mode pins
+        workers to all CPUs of NUMA nodes in turn.
+
+        @return: list of CPU sets or None if pinning is disabled
+        @rtype: list
+        """
+        mode = self.args.cpu_affinity
+        if not mode:
+            return None
+        if not hasattr(os, 'sched_setaffinity'):
+            self.logger.warning("CPU affinity is not supported, ignoring")
+            return None
+        available = os.sched_getaffinity(0)
+        if mode == 'numa':
+            nodes = [set(cpus) & available for cpus in get_numa_nodes()]
+            nodes = [cpus for cpus in nodes if cpus]
+            if nodes:
+                return nodes
+            self.logger.warning(
+                "NUMA topology is not available, pinning to single CPUs")
+        return [{cpu} for cpu in sorted(available)]
+
+    @asyncio.coroutine
+    def replace_workers(self, retiring):
+        """ Starts new workers and gracefully stops old ones.
+
+        Old workers are stopped after new ones are ready to accept
+        connections. If new workers are not ready in time, they are stopped
+        and old ones are kept.
+
+        @param retiring: list of workers to replace
+        @return: True if workers were replaced
+        @rtype: bool
+        """
+        timeout = self.args.graceful_timeout
+        for worker in retiring:
+            worker.replacing = True
+        started = [self.spawn_worker(slot=w.slot) for w in retiring]
+        try:
+            yield from asyncio.wait_for(
+                asyncio.gather(*[w.ready for w in started], loop=self.loop),
+                timeout, loop=self.loop)
+        except asyncio.TimeoutError:
+            self.logger.error(
+                "new workers are not ready in %s seconds" % timeout)
+            for worker in retiring:
+                worker.replacing = False
+            yield from self.stop_workers(started)
+            return False
+        if self._terminating:
+            yield from self.stop_workers(started)
+            return False
+        yield from self.stop_workers(retiring)
+        return True
+
+    @asyncio.coroutine
+    def stop_workers(self, workers):
+        """ Gracefully stops workers.
+
+        Workers waiting for restart after crash are not restarted.
+        """
+        running = []
+        for worker in workers:
+            if self.workers.get(worker.pid) is worker:
+                running.append(worker)
+            else:
+                worker.retiring = True
+        yield from asyncio.gather(
+            *[w.stop(self.args.graceful_timeout) for w in running
+              if not w.retiring],
+            loop=self.loop)
+
+    def load_application(self):
+        """ Loads application or checks that workers could load it.
+
+        With args.preload urlconf, views and middlewares are loaded and
+        compiled in supervisor, and workers inherit them copy-on-write.
+        Otherwise supervisor doesn't import application, so workers started
+        on reload load new code; application is checked in a forked process
+        and supervisor is blocked until it exits.
+
+        @return: whether application is loaded successfully
+        @rtype: bool
+        """
+        if self.args.preload:
+            return self.import_application()
+        pid = os.fork()
+        if not pid:
+            # child process never returns to supervisor code
+            try:
+                loaded = self.import_application()
+            except BaseException:
+                self.logger.exception("failed to load application")
+                loaded = False
+            os._exit(0 if loaded else 1)
+        _, status = os.waitpid(pid, 0)
+        return os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+    def import_application(self):
+        """ Loads application in current process.
+
+        @return: False if urlconf is invalid
+        @rtype: bool
+        """
+        try:
+            self.worker_class.child_process_class.load_application()
+        except UrlConfError as e:
+            self.logger.error(str(e))
+            return False
+        return True
+
     def start(self):
-        sock = self.open_socket()
+        if not self.load_application():
+            sys.exit(1)
+        self.open_sockets()
         self.prefork()
+        if self.args.preload:
+            self.preload()
+        self.cpu_sets = self.get_cpu_sets()
+        self.recycle_semaphore = asyncio.Semaphore(
+            max(1, self.args.recycle_batch), loop=self.loop)
         self.logger.info("starting workers...")
+        workers = self.args.workers
+        if self.args.max_workers:
+            workers = min(max(workers, self.args.min_workers),
+                          self.args.max_workers)
         # start processes
-        for idx in range(self.args.workers):
-            self.workers.append(self.worker_class(self.loop, self.args, sock))
+        for idx in range(workers):
+            self.spawn_worker()
 
         self.add_signal_handlers()
+        asyncio.async(self.report_workers(), loop=self.loop)
+        if self.args.max_workers:
+            asyncio.async(self.autoscale(), loop=self.loop)
         self.loop.run_forever()
+        self.remove_unix_sockets()
         if not self.args.no_daemon:
             self.delpid()
+        if self.exit_code:
+            sys.exit(self.exit_code)
 
     def waitpid(self):
         child = True
@@ -273,43 +1239,84 @@ class Supervisor:
                     self.logger.info(
                         "Child process %s exited with return code %s"
                         % (child, exitcode))
-                    if self._terminating:
-                        self.remove_worker(child)
+                    worker = self.workers.pop(child, None)
+                    if worker is None:
+                        self.logger.warning(
+                            "unregistered child process %s exited" % child)
+                    elif self._terminating or worker.retiring:
+                        self.remove_worker(worker)
                     else:
-                        self.restart_worker(child)
+                        self.restart_worker(worker, exitcode)
             except:
                 break
 
-    def remove_worker(self, pid):
-        worker = None
-        for worker in self.workers:
-            if worker.pid == pid:
-                break
-        if not worker:
-            self.logger.error("unregistered worker found, exiting")
-            self.loop.stop()
+    def remove_worker(self, worker):
+        """ Finishes exited worker."""
+        self.logger.debug("removing worker %s" % worker.pid)
+        self.workers.pop(worker.pid, None)
+        worker.close()
+        if not worker.exited.done():
+            worker.exited.set_result(worker.pid)
+
+    def restart_worker(self, worker, exitcode):
+        """ Restarts crashed worker with exponential backoff per slot.
+
+        If restart rate exceeds args.max_restarts in args.restart_window
+        seconds, supervisor considers workers crash-looping and exits.
+        """
+        pid = worker.pid
+        self.remove_worker(worker)
+        if self.is_crash_loop():
+            self.logger.error(
+                "workers restarted %s times in %s seconds, last one "
+                "exited with %s; they probably fail on startup, see errors "
+                "above. Exiting." % (
+                    len(self.restarts), self.args.restart_window,
+                    describe_exit_status(exitcode)))
+            self.exit_code = 1
+            self.stop()
             return
-        self.logger.debug("removing worker %s" % pid)
-        self.workers.remove(worker)
+        slot = worker.slot
+        if time.monotonic() - worker.started_at > self.stable_uptime:
+            self.failures[slot] = 0
+        delay = 0
+        if self.failures[slot]:
+            delay = min(self.restart_delay * 2 ** (self.failures[slot] - 1),
+                        self.max_restart_delay)
+        self.failures[slot] += 1
+        self.logger.debug("restarting worker %s in %s seconds" % (pid, delay))
+        self.pending_restarts[worker] = self.loop.call_later(
+            delay, self.respawn_worker, worker)
 
-    def restart_worker(self, pid):
-        worker = None
-        for worker in self.workers:
-            if worker.pid == pid:
-                break
-        if not worker:
-            self.logger.error("unregistered worker found, exiting")
-            self.loop.stop()
+    def respawn_worker(self, worker):
+        """ Starts new child process for a worker."""
+        del self.pending_restarts[worker]
+        if worker.retiring:
             return
-        self.logger.debug("restarting worker %s" % pid)
         try:
-            worker.kill()
+            worker.start()
         except Exception as err:
             self.logger.exception(
                 "Error while restarting worker (%s)" % err,
-                extra={"worker_pid": pid},
+                extra={"worker_pid": worker.pid},
             )
-        worker.start()
+            return
+        self.workers[worker.pid] = worker
+
+    def is_crash_loop(self):
+        """ Registers a restart and checks restart rate budget."""
+        if not self.args.max_restarts:
+            return False
+        now = time.monotonic()
+        self.restarts.append(now)
+        while self.restarts[0] < now - self.args.restart_window:
+            self.restarts.popleft()
+        return len(self.restarts) > self.args.max_restarts
+
+    def cancel_restarts(self):
+        for handle in self.pending_restarts.values():
+            handle.cancel()
+        self.pending_restarts.clear()
 
     def prefork(self):
         if not self.args.no_daemon:
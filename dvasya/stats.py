@@ -0,0 +1,355 @@
+# coding: utf-8
+
+# $Id: $
+
+# Request pipeline instrumentation.
+#
+# When INSTRUMENTATION setting is enabled, url resolver, every middleware
+# and view calls are timed with monotonic clock, and timings are stored
+# in per-process (so, per-worker) histograms keyed by route name and
+# pipeline stage.
+#
+# Middleware timings are inclusive: they contain timings of all inner
+# middlewares and view.
+#
+# Workers send their histograms to supervisor every stats interval;
+# supervisor merges them to cluster-wide timings, logs them and writes
+# them to stats file.
+#
+# Workers also report their counters to supervisor in compact binary frames
+# piggybacked on heartbeat pongs (see WorkerStats), and sample event loop
+# lag (see LoopLagMonitor).
+
+import asyncio
+from collections import namedtuple
+import struct
+import sys
+import threading
+import time
+import traceback
+
+from dvasya.logging import getLogger
+
+__all__ = ['Histogram', 'Timings', 'timings', 'WorkerStats',
+           'LoopLagMonitor']
+
+
+# route name for requests not matched by url resolver
+NOT_FOUND_ROUTE = '<not found>'
+
+# route name for requests with unknown route
+UNKNOWN_ROUTE = '<unknown>'
+
+
+class Histogram(object):
+    """ Log-scale latency histogram.
+
+    Bucket N counts values in [2 ** (N - 1), 2 ** N) microseconds.
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    buckets = 32
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        """ Adds value in seconds to histogram."""
+        bucket = int(value * 1000000).bit_length()
+        if bucket >= self.buckets:
+            bucket = self.buckets - 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """ Returns upper bound of bucket containing given percentile.
+
+        @param percent: percentile, from 0 to 100
+        @return: value in seconds
+        @rtype: float
+        """
+        if not self.count:
+            return 0.0
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold:
+                return min((1 << bucket) / 1000000.0, self.max)
+        return self.max
+
+    def summary(self):
+        """ Returns histogram summary.
+
+        @rtype: dict
+        """
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+    def dump(self):
+        """ Returns histogram state, which could be merged to another one.
+
+        @rtype: dict
+        """
+        return {'counts': self.counts, 'total': self.total, 'max': self.max}
+
+    def merge(self, state):
+        """ Adds values from other histogram state.
+
+        @param state: Histogram.dump() result
+        @type state: dict
+        """
+        counts = state['counts']
+        for bucket, count in enumerate(counts[:self.buckets]):
+            self.counts[bucket] += count
+        self.count += sum(counts)
+        self.total += state['total']
+        self.max = max(self.max, state['max'])
+
+
+class Timings(object):
+    """ Pipeline stage histograms keyed by route name."""
+
+    def __init__(self):
+        self.histograms = {}
+
+    def record(self, route, stage, value):
+        """ Records stage duration for a route.
+
+        @param route: route name
+        @param stage: pipeline stage name
+        @param value: duration in seconds
+        """
+        key = (route, stage)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.add(value)
+
+    def snapshot(self):
+        """ Returns summaries of all histograms.
+
+        @return: {route: {stage: summary}}
+        @rtype: dict
+        """
+        result = {}
+        for (route, stage), histogram in self.histograms.items():
+            result.setdefault(route, {})[stage] = histogram.summary()
+        return result
+
+    def dump(self):
+        """ Returns state of all histograms, i.e. to send it to supervisor.
+
+        @return: {route: {stage: histogram state}}
+        @rtype: dict
+        """
+        result = {}
+        for (route, stage), histogram in self.histograms.items():
+            result.setdefault(route, {})[stage] = histogram.dump()
+        return result
+
+    def merge(self, state):
+        """ Adds histograms from other Timings.dump() result."""
+        for route, stages in state.items():
+            for stage, histogram_state in stages.items():
+                key = (route, stage)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.merge(histogram_state)
+
+    def clear(self):
+        self.histograms.clear()
+
+
+timings = Timings()
+
+
+def get_route_name(request):
+    """ Returns route name stored in request match info by url resolver."""
+    match_info = getattr(request, 'match_info', None)
+    return getattr(match_info, 'route_name', None) or UNKNOWN_ROUTE
+
+
+def timed_middleware(factory, stage):
+    """ Wraps aiohttp middleware factory to record its timings.
+
+    @param factory: aiohttp middleware factory
+    @param stage: pipeline stage name
+    @return: middleware factory
+    """
+
+    @asyncio.coroutine
+    def timed_factory(app, handler):
+        middleware = yield from factory(app, handler)
+
+        @asyncio.coroutine
+        def timed(request):
+            start = time.monotonic()
+            try:
+                result = middleware(request)
+                if asyncio.iscoroutine(result):
+                    result = yield from result
+                return result
+            finally:
+                timings.record(get_route_name(request), stage,
+                               time.monotonic() - start)
+        return timed
+
+    return timed_factory
+
+
+# noinspection PyUnusedLocal
+@asyncio.coroutine
+def view_timer(app, handler):
+    """ Innermost middleware factory recording view timings."""
+
+    @asyncio.coroutine
+    def timed(request):
+        start = time.monotonic()
+        try:
+            result = handler(request)
+            if asyncio.iscoroutine(result):
+                result = yield from result
+            return result
+        finally:
+            timings.record(get_route_name(request), 'view',
+                           time.monotonic() - start)
+    return timed
+
+
+class WorkerStats(namedtuple('WorkerStats', (
+        'served', 'in_flight', 'loop_lag', 'rss', 'errors', 'accepted',
+        'busy'))):
+    """ Worker counters reported to supervisor.
+
+    served: requests finished by worker
+    in_flight: requests being handled
+    loop_lag: event loop lag in seconds
+    rss: resident memory in bytes
+    errors: requests finished with exception or 5xx response
+    accepted: connections accepted by worker
+    busy: share of time worker used CPU since previous report
+    """
+    __slots__ = ()
+
+    frame = struct.Struct('!QIfQIQf')
+
+    def pack(self):
+        """ Returns binary stats frame.
+
+        @rtype: bytes
+        """
+        return self.frame.pack(*self)
+
+    @classmethod
+    def unpack(cls, data):
+        """ Parses binary stats frame.
+
+        @raise struct.error: invalid frame
+        @rtype: WorkerStats
+        """
+        return cls._make(cls.frame.unpack(data))
+
+    @classmethod
+    def aggregate(cls, stats):
+        """ Summarizes stats of several workers.
+
+        Counters and busy shares are summed up, loop lag is maximum one.
+
+        @param stats: list of WorkerStats
+        @rtype: WorkerStats
+        """
+        if not stats:
+            return cls(0, 0, 0.0, 0, 0, 0, 0.0)
+        total = cls._make(map(sum, zip(*stats)))
+        return total._replace(loop_lag=max(s.loop_lag for s in stats))
+
+
+class LoopLagMonitor(object):
+    """ Event loop lag sampler with blocked loop watchdog.
+
+    Sampler coroutine sleeps for interval and records how much later it was
+    woken up. Watchdog thread logs stack of event loop thread when loop
+    doesn't run sampler for longer than threshold, so blocking code is
+    caught in action.
+    """
+    logger = getLogger('dvasya.worker')
+
+    def __init__(self, loop, interval, threshold):
+        """
+        @param loop: monitored event loop
+        @param interval: seconds between samples
+        @param threshold: lag in seconds to log loop thread stack
+        """
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.histogram = Histogram()
+        self.max_lag = 0.0
+        self.last_tick = None
+        self.thread_id = None
+        self.task = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """ Starts sampler and watchdog, must be called from loop thread."""
+        self.thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self.task = asyncio.async(self.sample(), loop=self.loop)
+        watchdog = threading.Thread(target=self.watch,
+                                    name='loop-lag-watchdog', daemon=True)
+        watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    @asyncio.coroutine
+    def sample(self):
+        while True:
+            start = time.monotonic()
+            yield from asyncio.sleep(self.interval, loop=self.loop)
+            now = time.monotonic()
+            self.last_tick = now
+            lag = max(now - start - self.interval, 0.0)
+            self.histogram.add(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def take_max_lag(self):
+        """ Returns max lag since previous call.
+
+        @rtype: float
+        """
+        lag, self.max_lag = self.max_lag, 0.0
+        return lag
+
+    def watch(self):
+        """ Watchdog thread main loop."""
+        reported = None
+        while not self._stopped.wait(self.interval):
+            tick = self.last_tick
+            lag = time.monotonic() - tick - self.interval
+            if lag <= self.threshold or tick == reported:
+                continue
+            # report every stall once
+            reported = tick
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.logger.warning(
+                'Event loop is blocked for %.3f seconds, stack:\n%s',
+                lag, ''.join(traceback.format_stack(frame)))
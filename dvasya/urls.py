@@ -9,13 +9,19 @@
 # supports root-level urls and include() function
 
 import asyncio
+import functools
+import inspect
 import re
+import time
 import aiohttp
 import aiohttp.web
 from aiohttp.abc import AbstractRouter, AbstractMatchInfo
+from aiohttp.web import HTTPRequestEntityTooLarge, Response
 from dvasya.conf import settings
-from dvasya.response import HttpResponseNotFound
+from dvasya.response import HttpResponseNotFound, HttpResponseNotAllowed
+from dvasya.stats import timings, NOT_FOUND_ROUTE, UNKNOWN_ROUTE
 from dvasya.utils import import_object
+from dvasya.views import View
 
 
 # noinspection PyUnusedLocal
@@ -36,20 +42,211 @@ def include(patterns_or_path):
     return patterns_or_path
 
 
+# regex characters which stop literal prefix of a pattern
+REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+# quantifiers which make previous character optional
+REGEX_OPTIONAL_QUANTIFIERS = frozenset('*?{')
+
+# inline flags could change matching of whole regex (i.e. (?i) )
+REGEX_INLINE_FLAGS = re.compile(r'\(\?[aiLmsux]')
+
+
+def literal_prefix(regex):
+    """ Returns literal string which starts every string matched by regex.
+
+    @param regex: url regular expression
+    @type regex: str
+
+    @return: literal prefix, possibly empty
+    @rtype: str
+    """
+    if '|' in regex or REGEX_INLINE_FLAGS.search(regex):
+        return ''
+    if regex.startswith('^'):
+        regex = regex[1:]
+    prefix = []
+    for char in regex:
+        if char in REGEX_OPTIONAL_QUANTIFIERS:
+            if prefix:
+                prefix.pop()
+            break
+        if char in REGEX_SPECIAL_CHARS:
+            break
+        prefix.append(char)
+    return ''.join(prefix)
+
+
+class PatternIndexNode:
+    """ Literal-prefix trie node."""
+    __slots__ = ('children', 'indices', 'patterns')
+
+    def __init__(self):
+        self.children = {}
+        self.indices = []
+        self.patterns = ()
+
+
+class PatternIndex:
+    """ Literal-prefix trie for an ordered list of url patterns.
+
+    Every trie node keeps all patterns which literal prefix is a prefix of
+    node's path, in urlconf order, so resolving a path is a walk through the
+    trie followed by matching only the patterns that could match at all.
+    First-match-wins order of the urlconf is kept.
+    """
+
+    def __init__(self, patterns):
+        self.root = PatternIndexNode()
+        patterns = list(patterns)
+        for idx, pattern in enumerate(patterns):
+            node = self.root
+            for char in literal_prefix(pattern.regex):
+                node = node.children.setdefault(char, PatternIndexNode())
+            node.indices.append(idx)
+        self._fill(self.root, [], patterns)
+
+    def _fill(self, node, inherited, patterns):
+        indices = sorted(inherited + node.indices)
+        node.patterns = tuple(patterns[i] for i in indices)
+        for child in node.children.values():
+            self._fill(child, indices, patterns)
+
+    def candidates(self, path):
+        """ Returns patterns that could match path, in urlconf order.
+
+        @param path: request path
+        @type path: str
+
+        @rtype: tuple
+        """
+        node = self.root
+        children = node.children
+        for char in path:
+            child = children.get(char)
+            if child is None:
+                break
+            node = child
+            children = node.children
+        return node.patterns
+
+
+class MethodTable:
+    """ HTTP method routing table for a view.
+
+    Answers OPTIONS and 405 Method Not Allowed without calling a view.
+    """
+
+    def __init__(self, handlers, options=True):
+        """
+        @param handlers: views by HTTP method name
+        @type handlers: dict
+        @param options: answer OPTIONS requests not handled by a view,
+            otherwise they are not allowed
+        """
+        self.handlers = {m.upper(): h for m, h in handlers.items()}
+        if 'GET' in self.handlers and 'HEAD' not in self.handlers:
+            self.handlers['HEAD'] = self.handlers['GET']
+        self.answer_options = options
+        methods = set(self.handlers)
+        if options:
+            methods.add('OPTIONS')
+        self.allowed_methods = sorted(methods)
+        self.allow = ', '.join(self.allowed_methods)
+
+    @classmethod
+    def for_view(cls, view_func):
+        """ Constructs routing table from view allowed methods.
+
+        @return: routing table or None, if view accepts any method
+        @rtype: MethodTable
+        """
+        allowed_methods = getattr(view_func, '_allowed_methods', None)
+        if allowed_methods is None:
+            return None
+        view_class = getattr(view_func, 'view_class', None)
+        if view_class is not None and view_class.dispatch is not View.dispatch:
+            # custom dispatch() could handle any method
+            return None
+        handlers = {m: view_func for m in allowed_methods}
+        if view_class is not None and view_class.options is View.options:
+            # default View.options() is answered from routing table
+            handlers.pop('options', None)
+        # view without "options" in http_method_names returns 405
+        return cls(handlers, options='options' in allowed_methods)
+
+    def get_handler(self, method):
+        """ Returns view for HTTP method."""
+        handler = self.handlers.get(method)
+        if handler is not None:
+            return handler
+        if method == 'OPTIONS' and self.answer_options:
+            return self.options
+        return self.not_allowed
+
+    def dispatch(self, request, *args, **kwargs):
+        handler = self.get_handler(request.method)
+        return handler(request, *args, **kwargs)
+
+    # noinspection PyUnusedLocal
+    def options(self, request, *args, **kwargs):
+        response = Response(status=204, text='')
+        response.headers['Allow'] = self.allow
+        return response
+
+    # noinspection PyUnusedLocal
+    def not_allowed(self, request, *args, **kwargs):
+        return HttpResponseNotAllowed(self.allowed_methods)
+
+
+class UrlMatch(tuple):
+    """ Url pattern match: view function, args and kwargs triple.
+
+    Also keeps route name of matched pattern for instrumentation and
+    request body size limit of the pattern.
+    """
+
+    def __new__(cls, view_func, args, kwargs, route_name=None,
+                max_body_size=None):
+        match = super().__new__(cls, (view_func, args, kwargs))
+        match.route_name = route_name
+        match.max_body_size = max_body_size
+        return match
+
+
 class UrlPattern:
     """ URL pattern matcher."""
-    def __init__(self, pattern, view_func, name=None):
+    def __init__(self, pattern, view_func, name=None, max_body_size=None):
+        """
+        @param pattern: url regular expression
+        @param view_func: view function or dict of views by HTTP method
+        @param name: url name for reverse()
+        @param max_body_size: request body size limit in bytes, None for
+            MAX_BODY_SIZE setting
+        """
         self._regex = pattern
+        if isinstance(view_func, dict):
+            self.method_table = MethodTable(view_func)
+            view_func = self.method_table.dispatch
+        else:
+            self.method_table = MethodTable.for_view(view_func)
         self.view_func = view_func
         self.name = name
+        self.route_name = name
+        self.max_body_size = max_body_size
         self.rx = None
 
     @property
     def regex(self):
         return self._regex
 
+    def compile_regex(self):
+        """ Compiles pattern's own regex, if not compiled yet."""
+        if self.rx is None:
+            self.rx = re.compile(self._regex)
+
     def compile(self):
-        self.rx = re.compile(self._regex)
+        self.compile_regex()
 
     def _match(self, path):
         if self.rx is None:
@@ -66,16 +263,31 @@ class UrlPattern:
             args = ()
         else:
             args = match.groups()
-        return self.view_func, args, kwargs
+        return UrlMatch(self.view_func, args, kwargs, self.route_name,
+                        self.max_body_size)
 
 
 class LocalUrlPattern(UrlPattern):
     """ Url pattern matcher for 'include' case."""
+    index = None
+
     # noinspection PyUnusedLocal
     def __init__(self, pattern, pattern_list, name=None):
         super(LocalUrlPattern, self).__init__(pattern, None)
         self.local_patterns = pattern_list
 
+    def build_index(self):
+        """ Builds literal-prefix index for included patterns recursively."""
+        self.index = PatternIndex(self.local_patterns)
+        for p in self.local_patterns:
+            if isinstance(p, LocalUrlPattern):
+                p.build_index()
+
+    def get_candidates(self, path):
+        if self.index is None:
+            return self.local_patterns
+        return self.index.candidates(path)
+
     def compile(self):
         super(LocalUrlPattern, self).compile()
         for p in self.local_patterns:
@@ -87,58 +299,298 @@ class LocalUrlPattern(UrlPattern):
             return None
         matched_part = match.group(0)
         rest_path = path[len(matched_part):]
-        for pattern in self.local_patterns:
+        for pattern in self.get_candidates(rest_path):
             match = pattern.resolve(rest_path)
             if match:
                 return match
-        pattern_list = [self._regex + ' ' + p.pattern
-                        for p in self.local_patterns]
-        raise HttpResponseNotFound(path=path, patterns=pattern_list)
+        raise HttpResponseNotFound(path=path, patterns=self.local_patterns,
+                                   prefix=self._regex)
+
+
+def iter_patterns(urlpatterns, prefix=''):
+    """ Iterates over url patterns recursively through includes.
+
+    Patterns that are not UrlPattern instances (i.e. django ones) are skipped.
+
+    @param urlpatterns: list of url patterns
+    @type urlpatterns: tuple | list
+
+    @param prefix: regex description prefix for included patterns
+
+    @return: generator of (full regex description, pattern) tuples
+    """
+    for pattern in urlpatterns:
+        if not isinstance(pattern, UrlPattern):
+            continue
+        regex = prefix + pattern.regex
+        yield regex, pattern
+        if isinstance(pattern, LocalUrlPattern):
+            yield from iter_patterns(pattern.local_patterns, regex + ' ')
+
+
+def iter_named_patterns(urlpatterns, includes=()):
+    """ Iterates over named url patterns recursively through includes.
 
+    @param urlpatterns: list of url patterns
+    @type urlpatterns: tuple | list
 
-def url(rx, view_or_patterns, name=None):
+    @param includes: regexes of include() patterns urlpatterns belong to
+    @type includes: tuple
+
+    @return: generator of (includes, pattern) tuples
+    """
+    for pattern in urlpatterns:
+        if isinstance(pattern, LocalUrlPattern):
+            yield from iter_named_patterns(pattern.local_patterns,
+                                           includes + (pattern.regex,))
+        elif isinstance(pattern, UrlPattern) and pattern.name:
+            yield includes, pattern
+
+
+class UrlConfError(ValueError):
+    """ Invalid url configuration."""
+
+
+class NoReverseMatch(Exception):
+    """ Url could not be constructed for view name and arguments."""
+
+
+def _group_end(regex, start):
+    """ Returns position after group which starts at regex[start]."""
+    depth = 0
+    in_class = False
+    pos = start
+    while pos < len(regex):
+        char = regex[pos]
+        if char == '\\':
+            pos += 2
+            continue
+        if in_class:
+            if char == ']':
+                in_class = False
+        elif char == '[':
+            in_class = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if not depth:
+                return pos + 1
+        pos += 1
+    raise ValueError("unbalanced parenthesis")
+
+
+def reverse_template(regex):
+    """ Converts url regex to str.format() template.
+
+    Only literal chars and non-optional groups are supported. Named and
+    positional groups can't be mixed.
+
+    @param regex: url regular expression
+    @type regex: str
+
+    @return: template, positional groups count and set of group names
+    @rtype: tuple
+
+    @raise ValueError: regex could not be reversed
+    """
+    if regex.startswith('^'):
+        regex = regex[1:]
+    if regex.endswith('$') and not regex.endswith('\\$'):
+        regex = regex[:-1]
+    parts = []
+    positional = 0
+    names = set()
+    pos = 0
+    while pos < len(regex):
+        char = regex[pos]
+        if char == '\\':
+            escaped = regex[pos + 1:pos + 2]
+            if not escaped or escaped.isalnum():
+                raise ValueError("%r outside of group" % regex[pos:pos + 2])
+            # literal braces are doubled for str.format()
+            parts.append(escaped.replace('{', '{{').replace('}', '}}'))
+            pos += 2
+            continue
+        if char == '(':
+            end = _group_end(regex, pos)
+            group = regex[pos:end]
+            if group.startswith('(?P<'):
+                name = group[4:group.index('>')]
+                names.add(name)
+                parts.append('{%s}' % name)
+            elif group.startswith('(?'):
+                raise ValueError("unsupported group %r" % group)
+            else:
+                parts.append('{%d}' % positional)
+                positional += 1
+            pos = end
+            if regex[pos:pos + 1] in ('*', '?', '{', '+'):
+                raise ValueError("quantified group %r" % group)
+            continue
+        if char in REGEX_SPECIAL_CHARS:
+            raise ValueError("unsupported char %r" % char)
+        parts.append(char)
+        pos += 1
+    if names and positional:
+        raise ValueError("named and positional groups are mixed")
+    return ''.join(parts), positional, frozenset(names)
+
+
+class ReverseRoute:
+    """ Url builder for named url pattern."""
+
+    def __init__(self, includes, pattern):
+        self.pattern = pattern
+        self.error = None
+        try:
+            prefix = []
+            for regex in includes:
+                template, positional, names = reverse_template(regex)
+                if positional or names:
+                    raise ValueError("include %r has groups" % regex)
+                prefix.append(template.format())
+            self.prefix = '/' + ''.join(prefix)
+            self.template, self.positional, self.names = reverse_template(
+                pattern.regex)
+        except ValueError as e:
+            self.error = "%r can't be reversed: %s" % (pattern.regex, e)
+
+    def reverse(self, args, kwargs):
+        """ Constructs url for positional or keyword arguments.
+
+        @rtype: str
+        @raise NoReverseMatch: pattern is not reversible or arguments
+            don't match it
+        """
+        if self.error:
+            raise NoReverseMatch(self.error)
+        if kwargs:
+            if args or set(kwargs) != self.names:
+                raise NoReverseMatch(
+                    "%r expects keyword arguments %s" % (
+                        self.pattern.regex, sorted(self.names)))
+            path = self.template.format(**kwargs)
+        else:
+            if self.names or len(args) != self.positional:
+                raise NoReverseMatch(
+                    "%r expects %d positional arguments" % (
+                        self.pattern.regex, self.positional))
+            path = self.template.format(*args)
+        match = self.pattern.rx.match(path)
+        if match is None or match.end() != len(path):
+            raise NoReverseMatch("%r does not match %r" % (
+                path, self.pattern.regex))
+        return self.prefix + path
+
+
+def url(rx, view_or_patterns, name=None, max_body_size=None):
     """ Constructs url pattern matcher from url definition.
     @see https://docs.djangoproject.com/en/dev/topics/http/urls/#example
 
     @param rx: url regular expression
     @type rx: str
 
-    @param view_or_patterns: view function or include(...) result
-    @type view_or_patterns: (function|tuple|list)
+    @param view_or_patterns: view function, dict of views by HTTP method
+        or include(...) result
+    @type view_or_patterns: (function|dict|tuple|list)
+
+    @param max_body_size: request body size limit in bytes for the view,
+        None for MAX_BODY_SIZE setting
+    @type max_body_size: int
 
     @return pattern matcher
     @rtype UrlPattern
     """
     if isinstance(view_or_patterns, (tuple, list)):
+        if max_body_size is not None:
+            raise ValueError("max_body_size is not supported for include()")
         return LocalUrlPattern(rx, view_or_patterns)
-    return UrlPattern(rx, view_or_patterns, name=name)
+    return UrlPattern(rx, view_or_patterns, name=name,
+                      max_body_size=max_body_size)
+
+
+# view kinds: plain function, coroutine function (including class-based
+# views) and generator function used as a coroutine
+VIEW_SYNC = 'sync'
+VIEW_COROUTINE = 'coroutine'
+VIEW_GENERATOR = 'generator'
+
+
+def get_view_kind(view_func):
+    """ Classifies view by what it returns when called.
+
+    @return: one of VIEW_SYNC, VIEW_COROUTINE or VIEW_GENERATOR
+    @rtype: str
+    """
+    view_class = getattr(view_func, 'view_class', None)
+    if (view_class is not None and
+            getattr(view_func, '_view_func', None) is not view_func):
+        # decorator copies view attributes, including coroutine marker,
+        # so it could return anything
+        return VIEW_SYNC
+    if view_class is not None:
+        if getattr(view_class, 'stateless', False):
+            # handler is called directly, it may be sync
+            return VIEW_SYNC
+        view_func = view_class.dispatch
+    if asyncio.iscoroutinefunction(view_func):
+        return VIEW_COROUTINE
+    if inspect.isgeneratorfunction(view_func):
+        return VIEW_GENERATOR
+    return VIEW_SYNC
 
 
 class RegexMatchInfo(AbstractMatchInfo):
-    """"""
+    """ Url resolving result.
+
+    Handler for coroutine views calls them directly; sync views are wrapped
+    into a coroutine.
+    """
+
+    # set by url resolver when instrumentation is enabled
+    route_name = None
+
+    # request body size limit in bytes, set by url resolver
+    max_body_size = None
 
-    def __init__(self, handler, args, kwargs):
+    def __init__(self, handler, args, kwargs, kind=VIEW_SYNC):
         self._handler = handler
         self._args = args
         self._kwargs = kwargs
+        self._kind = kind
 
     @asyncio.coroutine
     def _wrapper(self, request):
+        result = self._handler(request, *self._args, **self._kwargs)
+        if asyncio.iscoroutine(result):
+            # i.e. decorated class-based view
+            result = yield from result
+        return result
+
+    def _call(self, request):
         return self._handler(request, *self._args, **self._kwargs)
 
     @property
     def handler(self):
-        return self._wrapper
+        if self._kind is VIEW_SYNC:
+            return self._wrapper
+        return self._call
 
     @property
-    def route(self, *args, **kwargs):
-        # FIXME: fast stub to prevent ABCMeta TypeError
-        raise NotImplementedError()
+    def route(self):
+        # aiohttp calls only route.handle_expect_header()
+        return self
 
     @property
     def expect_handler(self):
         return aiohttp.web_urldispatcher._defaultExpectHandler
 
+    @asyncio.coroutine
+    def handle_expect_header(self, request):
+        """ Sends "100 Continue" for "Expect: 100-continue" requests."""
+        return (yield from self.expect_handler(request))
+
     @property
     def http_exception(self):
         return None
@@ -151,14 +603,160 @@ class UrlResolver(AbstractRouter):
 
     @classmethod
     def autodiscover(cls):
-        if not cls.resolver:
-            cls.resolver = UrlResolver()
-        return cls.resolver
+        """ Returns shared resolver instance for resolver class.
+
+        Supervisor calls it before forking workers, so they inherit
+        compiled urlconf.
+        """
+        resolver = cls.__dict__.get('resolver')
+        if resolver is None:
+            resolver = cls.resolver = cls()
+        return resolver
 
     def __init__(self, root_urlconf=None):
-        urlconf_module = root_urlconf or settings.ROOT_URLCONF
-        urlconf = __import__(urlconf_module, fromlist='urlpatterns')
+        self.root_urlconf = root_urlconf or settings.ROOT_URLCONF
+        self.cache = None
+        self.build()
+
+    def build(self):
+        """ (Re)builds url patterns from root urlconf.
+
+        Resolver cache is invalidated.
+        """
+        urlconf = __import__(self.root_urlconf, fromlist='urlpatterns')
         self.patterns = self.compile_patterns(urlconf.urlpatterns)
+        self.reverse_index = self.build_reverse_index(self.patterns)
+        self.method_tables = self.build_method_tables(self.patterns)
+        self.view_kinds = self.build_view_kinds(self.patterns)
+        self.instrumented = settings.INSTRUMENTATION
+        self.max_body_size = settings.MAX_BODY_SIZE
+        self.setup_cache()
+
+    def setup_cache(self):
+        """ Creates LRU cache for resolved paths.
+
+        Cache size is set by URL_RESOLVER_CACHE_SIZE setting, zero disables
+        cache. Not found paths are cached too.
+        """
+        size = settings.URL_RESOLVER_CACHE_SIZE
+        if size:
+            self.cache = functools.lru_cache(maxsize=size)(
+                self._resolve_or_none)
+        else:
+            self.cache = None
+        size = settings.URL_REVERSE_CACHE_SIZE
+        if size:
+            self.reverse_cache = functools.lru_cache(maxsize=size)(
+                self._reverse)
+        else:
+            self.reverse_cache = None
+
+    def cache_info(self):
+        """ Returns resolver cache statistics.
+
+        @return: hits, misses, maxsize and currsize or None if cache disabled
+        @rtype: functools._CacheInfo
+        """
+        if self.cache is None:
+            return None
+        return self.cache.cache_info()
+
+    def cache_clear(self):
+        """ Invalidates resolver cache."""
+        if self.cache is not None:
+            self.cache.cache_clear()
+        if self.reverse_cache is not None:
+            self.reverse_cache.cache_clear()
+
+    @staticmethod
+    def build_reverse_index(urlpatterns):
+        """ Indexes named url patterns across includes.
+
+        @type urlpatterns: tuple | list
+        @param urlpatterns: list of compiled url patterns
+
+        @return: url builders by url name
+        @rtype: dict
+        """
+        return {pattern.name: ReverseRoute(includes, pattern)
+                for includes, pattern in iter_named_patterns(urlpatterns)}
+
+    @staticmethod
+    def build_method_tables(urlpatterns):
+        """ Collects HTTP method routing tables for views.
+
+        @type urlpatterns: tuple | list
+        @param urlpatterns: list of compiled url patterns
+
+        @return: routing tables by view function
+        @rtype: dict
+        """
+        return {pattern.view_func: pattern.method_table
+                for _, pattern in iter_patterns(urlpatterns)
+                if pattern.method_table is not None}
+
+    @staticmethod
+    def build_view_kinds(urlpatterns):
+        """ Classifies all views and method handlers in urlconf.
+
+        @type urlpatterns: tuple | list
+        @param urlpatterns: list of compiled url patterns
+
+        @return: view kinds by view function
+        @rtype: dict
+        """
+        kinds = {}
+        for _, pattern in iter_patterns(urlpatterns):
+            views = [pattern.view_func]
+            if pattern.method_table is not None:
+                table = pattern.method_table
+                views.extend(table.handlers.values())
+                views.extend((table.options, table.not_allowed))
+            for view_func in views:
+                if view_func is not None:
+                    kinds[view_func] = get_view_kind(view_func)
+        return kinds
+
+    def get_view_kind(self, view_func):
+        """ Returns view kind, classifying unknown views once."""
+        try:
+            return self.view_kinds[view_func]
+        except KeyError:
+            kind = self.view_kinds[view_func] = get_view_kind(view_func)
+            return kind
+
+    def reverse(self, viewname, args=None, kwargs=None):
+        """ Constructs url for named url pattern.
+
+        Results are memoized for repeated arguments.
+
+        @param viewname: url pattern name
+        @type viewname: str
+
+        @param args: positional arguments for url regex groups
+        @param kwargs: keyword arguments for url regex named groups
+
+        @return: url path
+        @rtype: str
+
+        @raise NoReverseMatch: no url for name and arguments
+        """
+        args = tuple(args) if args else ()
+        kwargs = tuple(sorted(kwargs.items())) if kwargs else ()
+        if self.reverse_cache is None:
+            return self._reverse(viewname, args, kwargs)
+        try:
+            return self.reverse_cache(viewname, args, kwargs)
+        except TypeError:
+            # unhashable arguments
+            return self._reverse(viewname, args, kwargs)
+
+    def _reverse(self, viewname, args, kwargs):
+        try:
+            route = self.reverse_index[viewname]
+        except KeyError:
+            raise NoReverseMatch("No url named %r" % viewname)
+        return route.reverse(args, dict(kwargs))
 
     @asyncio.coroutine
     def resolve(self, request: aiohttp.web.Request) -> RegexMatchInfo:
@@ -169,36 +767,177 @@ class UrlResolver(AbstractRouter):
 
         @return: aiohttp url match info
         @rtype: RegexMatchInfo
+        @raise HTTPRequestEntityTooLarge: Content-Length exceeds request body
+            size limit
         """
+        if not self.instrumented:
+            match_info = self.get_match_info(request)
+            self.check_body_size(request, match_info)
+            return match_info
+        start = time.monotonic()
+        route = NOT_FOUND_ROUTE
+        try:
+            match_info = self.get_match_info(request)
+            # rejected requests are recorded for matched route
+            route = match_info.route_name
+            self.check_body_size(request, match_info)
+            return match_info
+        finally:
+            timings.record(route, 'resolve', time.monotonic() - start)
+
+    def get_match_info(self, request):
+        """ Resolves request to url match info.
 
+        @param request: http request object
+        @type request: aiohttp.web.Request
+
+        @rtype: RegexMatchInfo
+        """
         request_path = request.path.lstrip('/')
         request_path = request_path.split('?', 1)[0]
-        for pattern in self.patterns:
+        match = self.lookup(request_path)
+        view_func, args, kwargs = match
+        max_body_size = getattr(match, 'max_body_size', None)
+        if max_body_size is None:
+            max_body_size = self.max_body_size
+        method_table = self.method_tables.get(view_func)
+        if method_table is not None:
+            view_func = method_table.get_handler(request.method)
+        match_info = self.match_info_class(view_func, args, kwargs,
+                                           self.get_view_kind(view_func))
+        match_info.max_body_size = max_body_size
+        if self.instrumented:
+            match_info.route_name = getattr(match, 'route_name',
+                                            UNKNOWN_ROUTE)
+        return match_info
+
+    @staticmethod
+    def check_body_size(request, match_info):
+        """ Rejects request before body is read if Content-Length exceeds
+        body size limit of matched route.
+
+        Chunked body is limited while reading, see
+        dvasya.request.LimitedStreamReader.
+
+        @raise HTTPRequestEntityTooLarge: request body is too large
+        """
+        max_body_size = match_info.max_body_size
+        if max_body_size is None:
+            return
+        content_length = request.content_length
+        if content_length is not None and content_length > max_body_size:
+            raise HTTPRequestEntityTooLarge(
+                text="Request body exceeds %s bytes" % max_body_size)
+
+    def lookup(self, request_path):
+        """ Resolves request path through resolver cache.
+
+        @param request_path: request path without leading slash
+        @type request_path: str
+
+        @return: view function, positional and keyword arguments
+        @rtype: tuple
+        """
+        if self.cache is None:
+            return self.resolve_path(request_path)
+        match = self.cache(request_path)
+        if match is None:
+            if settings.DEBUG:
+                # render urlconf dump for not found page
+                return self.resolve_path(request_path)
+            raise HttpResponseNotFound(path=request_path)
+        return match
+
+    def _resolve_or_none(self, request_path):
+        try:
+            return self.resolve_path(request_path)
+        except HttpResponseNotFound:
+            return None
+
+    def resolve_path(self, request_path):
+        """ Finds a view for request path.
+
+        @param request_path: request path without leading slash
+        @type request_path: str
+
+        @return: view function, positional and keyword arguments
+        @rtype: tuple
+        """
+        for pattern in self.get_candidates(request_path):
             match = self.match_pattern(pattern, request_path)
             if not match:
                 continue
-            return self.match_info_class(*match)
-        raise HttpResponseNotFound(path=request_path,
-                                   patterns=[p.regex for p in self.patterns])
+            return match
+        raise HttpResponseNotFound(path=request_path, patterns=self.patterns)
+
+    def get_candidates(self, request_path):
+        """ Returns patterns to match request path against, in order."""
+        return self.patterns
 
     @staticmethod
     def compile_patterns(urlpatterns):
         """Compiles url patterns
 
+        All patterns are compiled recursively through includes.
+
         @type urlpatterns: tuple | list
         @param urlpatterns: list of url patterns
 
         @return: list of compiled url patterns
         @rtype: list
+
+        @raise UrlConfError: invalid regex or duplicate url names found
         """
-        result = []
-        for pattern in urlpatterns:
-            result.append(pattern)
+        result = list(urlpatterns)
+        errors = []
+        names = {}
+        for regex, pattern in iter_patterns(result):
+            try:
+                pattern.compile_regex()
+            except re.error as e:
+                errors.append("%r: %s" % (regex, e))
+                continue
+            pattern.route_name = pattern.name or regex
+            if pattern.name:
+                names.setdefault(pattern.name, []).append(regex)
+        for name, regexes in sorted(names.items()):
+            if len(regexes) > 1:
+                errors.append("duplicate url name %r: %s" % (
+                    name, ', '.join(repr(r) for r in regexes)))
+        if errors:
+            raise UrlConfError("Invalid urlconf:\n  %s" % '\n  '.join(errors))
         return result
 
     def match_pattern(self, pattern, request_path):
         return pattern.resolve(request_path)
 
 
+class CompiledUrlResolver(UrlResolver):
+    """ URL resolver that dispatches through literal-prefix tries.
+
+    Whole urlconf, including nested includes, is indexed at startup, so
+    only patterns which literal prefix matches request path are tried.
+    Returns same results as UrlResolver.
+    """
+
+    def build(self):
+        super().build()
+        self.index = PatternIndex(self.patterns)
+        for pattern in self.patterns:
+            if isinstance(pattern, LocalUrlPattern):
+                pattern.build_index()
+
+    def get_candidates(self, request_path):
+        return self.index.candidates(request_path)
+
+
 def load_resolver():
     return import_object(settings.URL_RESOLVER_CLASS)
+
+
+def reverse(viewname, args=None, kwargs=None):
+    """ Constructs url for named url pattern with global resolver.
+
+    @see UrlResolver.reverse
+    """
+    return load_resolver().autodiscover().reverse(viewname, args, kwargs)
@@ -1,6 +1,9 @@
 # coding: utf-8
 
 # $Id: $
+import asyncio
+import gc
+import os
 
 
 def import_object(class_path):
@@ -27,3 +30,132 @@ def qsl_to_dict(qsl):
         else:
             result[key] = value
     return result
+
+
+def set_event_loop_policy(policy_path, logger):
+    """ Installs event loop policy.
+
+    If policy class can't be imported or instantiated, default policy is
+    kept.
+
+    @param policy_path: full class path of event loop policy or None
+    @param logger: logger for import errors
+    @return: installed policy or None
+    """
+    if not policy_path:
+        return None
+    try:
+        policy_class = import_object(policy_path)
+    except (ImportError, AttributeError, ValueError) as e:
+        logger.warning("Can't import event loop policy %s (%s), "
+                       "using default event loop", policy_path, e)
+        return None
+    try:
+        policy = policy_class()
+        if not isinstance(policy, asyncio.AbstractEventLoopPolicy):
+            raise TypeError("%r is not an event loop policy" % policy)
+    except Exception as e:
+        logger.warning("Can't create event loop policy %s (%s), "
+                       "using default event loop", policy_path, e)
+        return None
+    asyncio.set_event_loop_policy(policy)
+    return policy
+
+
+def freeze_heap():
+    """ Moves all tracked objects to permanent generation.
+
+    Frozen objects are ignored by garbage collector, so it doesn't write to
+    memory pages shared by forked processes. No-op if gc.freeze() is not
+    available (python < 3.7).
+
+    @return: number of frozen objects or None if not supported
+    @rtype: int
+    """
+    freeze = getattr(gc, 'freeze', None)
+    if freeze is None:
+        return None
+    gc.collect()
+    freeze()
+    return gc.get_freeze_count()
+
+
+def unfreeze_heap():
+    """ Moves frozen objects back to the oldest generation.
+
+    Called by supervisor after fork, so its own garbage is collected. No-op
+    if gc.unfreeze() is not available (python < 3.7).
+    """
+    unfreeze = getattr(gc, 'unfreeze', None)
+    if unfreeze is not None:
+        unfreeze()
+
+
+def parse_cpu_list(cpu_list):
+    """ Parses linux cpu list format, i.e. "0-3,8,10-11".
+
+    @type cpu_list: str
+    @rtype: list
+    """
+    cpus = []
+    for part in cpu_list.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def get_numa_nodes():
+    """ Returns cpus of each NUMA node from sysfs (linux only).
+
+    @return: list of cpu lists, empty if NUMA topology is not available
+    @rtype: list
+    """
+    root = '/sys/devices/system/node'
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return []
+    nodes = []
+    for name in names:
+        if not name.startswith('node') or not name[4:].isdigit():
+            continue
+        try:
+            with open(os.path.join(root, name, 'cpulist')) as f:
+                cpus = parse_cpu_list(f.read())
+        except OSError:
+            continue
+        if cpus:
+            nodes.append((int(name[4:]), cpus))
+    return [cpus for _, cpus in sorted(nodes)]
+
+
+def get_memory_usage(pid):
+    """ Returns unique and shared resident memory of a process.
+
+    Reads /proc/<pid>/smaps_rollup or /proc/<pid>/smaps (linux only).
+
+    @param pid: process id
+    @type pid: int
+
+    @return: unique and shared memory in bytes or None if not available
+    @rtype: tuple
+    """
+    for name in ('smaps_rollup', 'smaps'):
+        try:
+            with open('/proc/%s/%s' % (pid, name)) as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        break
+    else:
+        return None
+    unique = shared = 0
+    for line in lines:
+        key, _, value = line.partition(':')
+        if key in ('Private_Clean', 'Private_Dirty'):
+            unique += int(value.split()[0]) * 1024
+        elif key in ('Shared_Clean', 'Shared_Dirty'):
+            shared += int(value.split()[0]) * 1024
+    return unique, shared
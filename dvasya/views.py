@@ -11,6 +11,7 @@
 
 from functools import update_wrapper
 import asyncio
+from types import MappingProxyType
 from aiohttp.web import Response
 from dvasya.response import HttpResponseNotAllowed
 
@@ -26,6 +27,11 @@ class View(object):
                          'options', 'trace']
     http_empty_body_methods = ['get', 'delete', 'head', 'options']
 
+    # if True, as_view() creates single view instance for all requests.
+    # Such views must not keep request state in self and must not
+    # override dispatch().
+    stateless = False
+
     def __init__(self, **kwargs):
         """
         Constructor. Called in the URLconf; can contain helpful extra
@@ -36,6 +42,27 @@ class View(object):
         for key, value in kwargs.items():
             setattr(self, key, value)
 
+    @classmethod
+    def get_dispatch_table(cls):
+        """ Returns immutable HTTP method to unbound handler table.
+
+        Table and Allow header value are built once per class.
+        """
+        table = cls.__dict__.get('_dispatch_table')
+        if table is not None:
+            return table
+        handlers = {}
+        for method in cls.http_method_names:
+            handler = getattr(cls, method, None)
+            if handler is not None:
+                handlers[method.upper()] = handler
+        if 'GET' in handlers and 'HEAD' not in handlers:
+            handlers['HEAD'] = handlers['GET']
+        cls._permitted_methods = tuple(sorted(handlers))
+        cls._allow_header = ', '.join(cls._permitted_methods)
+        cls._dispatch_table = table = MappingProxyType(handlers)
+        return table
+
     @classmethod
     def as_view(cls, **init_kwargs):
         """
@@ -54,14 +81,28 @@ class View(object):
                     "only accepts arguments that are already "
                     "attributes of the class." % (cls.__name__, key))
 
-        def view(request, *args, **kwargs):
-            self = cls(**init_kwargs)
-            if hasattr(self, 'get') and not hasattr(self, 'head'):
-                self.head = self.get
-            self.request = request
-            self.args = args
-            self.kwargs = kwargs
-            return self.dispatch(request, *args, **kwargs)
+        table = cls.get_dispatch_table()
+
+        if cls.stateless:
+            if cls.dispatch is not View.dispatch:
+                raise TypeError(
+                    "Stateless view %s can't override dispatch()"
+                    % cls.__name__)
+            instance = cls(**init_kwargs)
+
+            def view(request, *args, **kwargs):
+                handler = table.get(request.method)
+                if handler is None:
+                    return instance.http_method_not_allowed(
+                        request, *args, **kwargs)
+                return handler(instance, request, *args, **kwargs)
+        else:
+            def view(request, *args, **kwargs):
+                self = cls(**init_kwargs)
+                self.request = request
+                self.args = args
+                self.kwargs = kwargs
+                return self.dispatch(request, *args, **kwargs)
 
         # take name and docstring from class
         update_wrapper(view, cls, updated=())
@@ -72,29 +113,26 @@ class View(object):
         # add methods info for router
         class_methods = [m for m in cls.http_method_names if hasattr(cls, m)]
         view._allowed_methods = class_methods
+        view.view_class = cls
+        # decorators copy function attributes, so undecorated view is
+        # recognized by identity
+        view._view_func = view
         return view
 
     @asyncio.coroutine
     def dispatch(self, request, *args, **kwargs):
         """ Asynchronous request dispatcher.
 
-        Calls class initializer if necessary and dispatches request
-        to a corresponding handler by HTTP method name.
+        Dispatches request to a corresponding handler by HTTP method name
+        using class dispatch table.
         """
         # Try to dispatch to the right method; if a method doesn't exist,
-        # defer to the error handler. Also defer to the error handler if the
-        # request method isn't on the approved list.
-        self.request = request
-        self.args = args
-        self.kwargs = kwargs
-        method = request.method.lower()
-        if method in self.http_method_names:
-            handler = getattr(self, method,
-                              self.http_method_not_allowed)
+        # defer to the error handler.
+        handler = self.get_dispatch_table().get(request.method)
+        if handler is None:
+            result = self.http_method_not_allowed(request, *args, **kwargs)
         else:
-            handler = self.http_method_not_allowed
-
-        result = handler(request, *args, **kwargs)
+            result = handler(self, request, *args, **kwargs)
         if asyncio.iscoroutine(result):
             result = yield from result
         return result
@@ -106,10 +144,11 @@ class View(object):
         """
         Handles responding to requests for the OPTIONS HTTP verb.
         """
+        self.get_dispatch_table()
         response = Response(status=204, text='')
-        response.headers['Allow'] = ', '.join(self._allowed_methods())
+        response.headers['Allow'] = self._allow_header
         return response
 
     def _allowed_methods(self):
-        return sorted([m.upper() for m in self.http_method_names
-                       if hasattr(self, m)])
+        self.get_dispatch_table()
+        return self._permitted_methods
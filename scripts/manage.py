@@ -12,13 +12,89 @@ ARGS.add_argument(
 ARGS.add_argument(
     '--port', action="store", dest='port',
     default=8080, type=int, help='Port number')
+ARGS.add_argument(
+    '--bind', action="append", dest='bind', default=None,
+    help='Address to listen, "host:port" or "unix:/path/to/socket"; '
+         'could be repeated, overrides --host and --port')
+ARGS.add_argument(
+    '--backlog', action="store", dest='backlog',
+    default=1024, type=int, help='Pending connections queue length')
 ARGS.add_argument(
     '--workers', action="store", dest='workers',
     default=2, type=int, help='Number of workers.')
+ARGS.add_argument(
+    '--reuse-port', action="store_true", dest="reuse_port",
+    default=False, help="each worker listens own SO_REUSEPORT socket"
+)
+ARGS.add_argument(
+    '--preload', action="store_true", dest="preload",
+    default=False,
+    help="load application in supervisor and freeze its heap before "
+         "forking workers; reload doesn't pick up code changes"
+)
+ARGS.add_argument(
+    '--min-workers', action="store", dest="min_workers",
+    default=1, type=int, help='Minimum number of workers when autoscaling'
+)
+ARGS.add_argument(
+    '--max-workers', action="store", dest="max_workers",
+    default=0, type=int,
+    help='Maximum number of workers, enables autoscaling if set'
+)
+ARGS.add_argument(
+    '--cpu-affinity', action="store", dest="cpu_affinity",
+    default=None, choices=('auto', 'numa'),
+    help='pin each worker to own CPU (auto) or to NUMA node CPUs (numa)'
+)
 ARGS.add_argument(
     '--heartbeat', action="store", dest="heartbeat",
     default=15, type=int, help='Seconds between heartbeat pings'
 )
+ARGS.add_argument(
+    '--graceful-timeout', action="store", dest="graceful_timeout",
+    default=30, type=int,
+    help='Seconds for stopped worker to finish open connections'
+)
+ARGS.add_argument(
+    '--reload-batch', action="store", dest="reload_batch",
+    default=1, type=int, help='Number of workers replaced at once on SIGHUP'
+)
+ARGS.add_argument(
+    '--max-requests', action="store", dest="max_requests",
+    default=0, type=int,
+    help='Requests served by worker before recycling, 0 to disable'
+)
+ARGS.add_argument(
+    '--max-requests-jitter', action="store", dest="max_requests_jitter",
+    default=0, type=int, help='Random number of requests added to limit'
+)
+ARGS.add_argument(
+    '--max-rss', action="store", dest="max_rss",
+    default=0, type=int,
+    help='Worker resident memory in MB before recycling, 0 to disable'
+)
+ARGS.add_argument(
+    '--recycle-batch', action="store", dest="recycle_batch",
+    default=1, type=int, help='Number of workers recycled at once'
+)
+ARGS.add_argument(
+    '--stats-interval', action="store", dest="stats_interval",
+    default=60, type=int, help='Seconds between worker stats reports'
+)
+ARGS.add_argument(
+    '--stats-file', action="store", dest="stats_file",
+    default=None, type=str, help='Path to write worker stats JSON to'
+)
+ARGS.add_argument(
+    '--max-restarts', action="store", dest="max_restarts",
+    default=None, type=int,
+    help='Worker restarts in restart window to exit on, 0 to disable; '
+         'twice the number of workers but at least 10 by default'
+)
+ARGS.add_argument(
+    '--restart-window', action="store", dest="restart_window",
+    default=60, type=int, help='Seconds to count worker restarts in'
+)
 ARGS.add_argument(
     '--settings', action="store", dest="settings",
     default=None, type=str, help='DVASYA_SETTING_MODULE'
@@ -42,6 +118,10 @@ def main():
     if ':' in args.host:
         args.host, port = args.host.split(':', 1)
         args.port = int(port)
+    if args.max_restarts is None:
+        # budget grows with pool, so one wave of OOM kills is not a loop
+        workers = max(args.workers, args.max_workers)
+        args.max_restarts = max(10, 2 * workers)
     if args.settings:
         os.environ["DVASYA_SETTINGS_MODULE"] = args.settings
     from dvasya.server import Supervisor
@@ -6,8 +6,10 @@ from testapp import views
 
 
 included = patterns('',
-    url('^test_args/([\d]+)/([\w]+)/', views.function_view),
-    url('^test_args_kwargs/([\d]+)/(?P<kwarg>[\w]+)/', views.function_view),
+    url('^test_args/([\d]+)/([\w]+)/', views.function_view,
+        name='test_args'),
+    url('^test_args_kwargs/([\d]+)/(?P<kwarg>[\w]+)/', views.function_view,
+        name='test_args_kwargs'),
     url('^test_include/$', views.function_view)
 )
 
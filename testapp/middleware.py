@@ -0,0 +1,44 @@
+# coding: utf-8
+
+# $Id: $
+import asyncio
+from aiohttp.web import Response
+from dvasya.middleware import DvasyaMiddlewareBase
+
+
+class OuterMiddleware(DvasyaMiddlewareBase):
+    """ Adds header to every response."""
+
+    def process_response(self, request, response):
+        response.headers.setdefault('X-Middlewares', '')
+        response.headers['X-Middlewares'] += 'outer;'
+        return response
+
+
+class NoopMiddleware(DvasyaMiddlewareBase):
+    """ Middleware without hooks."""
+
+
+class ShortcutMiddleware(DvasyaMiddlewareBase):
+    """ Returns response without calling view if requested."""
+
+    @asyncio.coroutine
+    def process_request(self, request):
+        if 'shortcut' in request.GET:
+            return Response(text='shortcut')
+        return None
+
+    @asyncio.coroutine
+    def process_response(self, request, response):
+        response.headers.setdefault('X-Middlewares', '')
+        response.headers['X-Middlewares'] += 'shortcut;'
+        return response
+
+
+class ExceptionMiddleware(DvasyaMiddlewareBase):
+    """ Converts view exceptions to 418 responses if requested."""
+
+    def process_exception(self, request, exc):
+        if 'teapot' in request.GET:
+            return Response(status=418, text=str(exc))
+        return None
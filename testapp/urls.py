@@ -8,7 +8,9 @@ from testapp import views
 urlpatterns = patterns('',
     url('^include/', include('testapp.included_urls.included')),
     url('^class/', views.ClassBasedView.as_view()),
-    url('^function/$', views.function_view),
+    url('^function/$', views.function_view, name='function'),
     url('^json/$', views.json_view),
     url('^cookies/$', views.cookie_view),
+    url('^methods/$', {'GET': views.json_view, 'POST': views.function_view}),
+    url('^limited/$', views.function_view, max_body_size=16),
 )
@@ -1,20 +1,46 @@
 # coding: utf-8
 
 # $Id: $
+import asyncio
 from collections import OrderedDict
 import copy
+import functools
 import json
 import os
+import signal
+import socket
+import tempfile
+import struct
+import time
+import types
 from unittest import mock
 from urllib import parse
 
+from aiohttp.multidict import CIMultiDict
 from aiohttp.protocol import HttpMessage
-from aiohttp.web import Response
+from aiohttp import web
+from aiohttp.web import Response, HTTPRequestEntityTooLarge
 
 os.environ.setdefault("DVASYA_SETTINGS_MODULE", 'testapp.settings')
 
 
-from dvasya.test_utils import DvasyaTestCase  # noqa
+from dvasya.middleware import load_middlewares, MiddlewareChain  # noqa
+from dvasya.multipart import MultipartParser, MultipartError  # noqa
+from dvasya.request import DvasyaRequestProxy, read_body  # noqa
+from dvasya.response import HttpResponseNotFound, NOT_FOUND_BODY  # noqa
+from dvasya.server import Autoscaler, ChildProcess, Supervisor, Worker  # noqa
+from dvasya.server import bind_socket, parse_address  # noqa
+from dvasya.stats import Histogram, Timings, timings, NOT_FOUND_ROUTE  # noqa
+from dvasya.stats import WorkerStats, LoopLagMonitor  # noqa
+from dvasya.test_utils import DvasyaTestCase, override_settings  # noqa
+from dvasya.utils import get_memory_usage, parse_cpu_list  # noqa
+from dvasya.utils import set_event_loop_policy  # noqa
+from dvasya.urls import UrlResolver, CompiledUrlResolver, literal_prefix  # noqa
+from dvasya.urls import url, include, reverse, UrlConfError  # noqa
+from dvasya.urls import MethodTable, NoReverseMatch, RegexMatchInfo  # noqa
+from dvasya.urls import get_view_kind  # noqa
+from dvasya.urls import VIEW_SYNC, VIEW_COROUTINE, VIEW_GENERATOR  # noqa
+from dvasya.views import View  # noqa
 from testapp import views  # noqa
 
 
@@ -92,6 +118,128 @@ class DvasyaGenericViewsTestCase(DvasyaServerTestCaseBase):
         methods = sorted(allow.split(', '))
         expected = ['GET', 'POST', 'PUT', 'DELETE', 'HEAD', 'OPTIONS']
         self.assertListEqual(methods, sorted(expected))
+        self.assertFalse(self.mock.called)
+
+    def testOptions(self):
+        url = "/class/not_used/"
+        response = self.client.request('OPTIONS', url, b'')
+        self.assertEqual(response.status, 204)
+        self.assertEqual(response.headers.get('ALLOW'),
+                         'DELETE, GET, HEAD, OPTIONS, POST, PUT')
+        self.assertFalse(self.mock.called)
+
+    def testMethodViews(self):
+        url = "/methods/"
+        response = self.client.get(url)
+        self.assertEqual(response.text, '{"ok": true}')
+        response = self.client.head(url)
+        self.assertEqual(response.status, 200)
+        response = self.client.post(url)
+        self.assertEqual(response.status, 200)
+        self.assertTrue(self.mock.called)
+        response = self.client.delete(url)
+        self.assertEqual(response.status, 405)
+        self.assertEqual(response.headers.get('ALLOW'),
+                         'GET, HEAD, OPTIONS, POST')
+
+
+class ViewDispatchTableTestCase(DvasyaTestCase):
+    def testDispatchTable(self):
+        table = views.ClassBasedView.get_dispatch_table()
+        self.assertIs(table['GET'], views.ClassBasedView.any_method)
+        self.assertNotIn('PATCH', table)
+        with self.assertRaises(TypeError):
+            table['PATCH'] = views.ClassBasedView.any_method
+        self.assertEqual(views.ClassBasedView._allow_header,
+                         'DELETE, GET, HEAD, OPTIONS, POST, PUT')
+
+    def testHeadFallsBackToGet(self):
+        table = views.DefaultView.get_dispatch_table()
+        self.assertIs(table['HEAD'], views.DefaultView.get)
+
+    def testStatelessView(self):
+        instances = []
+
+        class StatelessView(View):
+            stateless = True
+
+            def get(self, request, *args, **kwargs):
+                instances.append(self)
+                return Response(text=kwargs['arg'])
+
+        view = StatelessView.as_view()
+        request = mock.Mock(method='GET')
+        for _ in range(2):
+            self.assertEqual(view(request, arg='ok').text, 'ok')
+        self.assertIs(instances[0], instances[1])
+        request.method = 'PATCH'
+        self.assertEqual(view(request).status, 405)
+
+    def testOptionsNotAllowed(self):
+        class GetView(View):
+            http_method_names = ['get']
+
+            def get(self, request, *args, **kwargs):
+                return Response(text='ok')
+
+        view = GetView.as_view()
+        table = MethodTable.for_view(view)
+        request = mock.Mock(method='OPTIONS')
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        expected = loop.run_until_complete(view(request))
+        response = table.dispatch(request)
+        # routing table answers same as the view does
+        self.assertEqual((response.status, response.headers['Allow']),
+                         (expected.status, expected.headers['Allow']))
+        self.assertEqual(response.status, 405)
+
+    def testViewKinds(self):
+        self.assertEqual(get_view_kind(views.patched_function_view),
+                         VIEW_COROUTINE)
+        self.assertEqual(get_view_kind(views.dump_params), VIEW_GENERATOR)
+        self.assertEqual(get_view_kind(views.function_view), VIEW_SYNC)
+        self.assertEqual(get_view_kind(views.ClassBasedView.as_view()),
+                         VIEW_COROUTINE)
+
+    def testDecoratedViewKind(self):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(request, *args, **kwargs):
+                return Response(text='decorated')
+            return wrapper
+
+        view = decorator(views.ClassBasedView.as_view())
+        self.assertEqual(get_view_kind(view), VIEW_SYNC)
+        match_info = RegexMatchInfo(view, (), {}, get_view_kind(view))
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        response = loop.run_until_complete(
+            match_info.handler(mock.Mock()))
+        self.assertEqual(response.text, 'decorated')
+
+        def passthrough(func):
+            @functools.wraps(func)
+            def wrapper(request, *args, **kwargs):
+                return func(request, *args, **kwargs)
+            return wrapper
+
+        # decorator returning view coroutine
+        view = passthrough(views.ClassBasedView.as_view())
+        match_info = RegexMatchInfo(view, (), {}, get_view_kind(view))
+        response = loop.run_until_complete(
+            match_info.handler(mock.Mock(method='PATCH')))
+        self.assertEqual(response.status, 405)
+
+    def testStatelessDispatchOverride(self):
+        class StatelessView(View):
+            stateless = True
+
+            def dispatch(self, request, *args, **kwargs):
+                pass
+
+        with self.assertRaises(TypeError):
+            StatelessView.as_view()
 
 
 class UrlResolverTestCase(DvasyaServerTestCaseBase):
@@ -144,6 +292,145 @@ class UrlResolverTestCase(DvasyaServerTestCaseBase):
         self.assertIn("nomatch", result.text)
         self.assertIn("include", result.text)
 
+    def testIncludedNoMatch(self):
+        url = "/include/nomatch/"
+        result = self.client.get(url)
+        self.assertNoMatch(result)
+        self.assertIn("^include/ ^test_include/$", result.text)
+
+    def testNoMatchWithoutDebug(self):
+        url = "/nomatch/"
+        with override_settings(DEBUG=False):
+            result = self.client.get(url)
+        self.assertEqual(result.status, 404)
+        self.assertEqual(result.body, NOT_FOUND_BODY)
+
+
+class CompiledUrlResolverTestCase(UrlResolverTestCase):
+    resolver_class = CompiledUrlResolver
+
+    def testLiteralPrefix(self):
+        self.assertEqual(literal_prefix('^function/$'), 'function/')
+        self.assertEqual(literal_prefix('^test/([\\d]+)/'), 'test/')
+        self.assertEqual(literal_prefix('^items?/'), 'item')
+        self.assertEqual(literal_prefix('^a+b'), 'a')
+        self.assertEqual(literal_prefix('^a|b'), '')
+        self.assertEqual(literal_prefix('(?i)^abc'), '')
+
+
+class UrlConfValidationTestCase(DvasyaTestCase):
+    def testPatternsCompiled(self):
+        resolver = UrlResolver(root_urlconf='testapp.urls')
+        included = resolver.patterns[0].local_patterns
+        for pattern in list(resolver.patterns) + list(included):
+            self.assertIsNotNone(pattern.rx)
+
+    def testInvalidRegex(self):
+        urlpatterns = [
+            url('^ok/$', views.function_view),
+            url('^include/', include([
+                url('^broken(/$', views.function_view),
+            ])),
+        ]
+        with self.assertRaises(UrlConfError) as ctx:
+            UrlResolver.compile_patterns(urlpatterns)
+        self.assertIn("'^include/ ^broken(/$'", str(ctx.exception))
+
+    def testDuplicateNames(self):
+        urlpatterns = [
+            url('^one/$', views.function_view, name='view'),
+            url('^include/', include([
+                url('^two/$', views.function_view, name='view'),
+            ])),
+        ]
+        with self.assertRaises(UrlConfError) as ctx:
+            UrlResolver.compile_patterns(urlpatterns)
+        self.assertIn("duplicate url name 'view'", str(ctx.exception))
+
+
+class ReverseTestCase(DvasyaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.resolver = UrlResolver(root_urlconf='testapp.urls')
+
+    def testReverse(self):
+        self.assertEqual(self.resolver.reverse('function'), '/function/')
+
+    def testReverseIncludedArgs(self):
+        path = self.resolver.reverse('test_args', args=(123, 'val'))
+        self.assertEqual(path, '/include/test_args/123/val/')
+        self.assertEqual(self.resolver.lookup(path.lstrip('/'))[1],
+                         ('123', 'val'))
+
+    def testReverseKwargs(self):
+        urlpatterns = [url('^item/(?P<pk>\\d+)/$', views.function_view,
+                           name='item')]
+        index = UrlResolver.build_reverse_index(
+            UrlResolver.compile_patterns(urlpatterns))
+        self.assertEqual(index['item'].reverse((), {'pk': 1}), '/item/1/')
+
+    def testReverseEscapedBraces(self):
+        urlpatterns = [url('^\\{a\\}/', [
+            url('^item\\{(?P<pk>\\d+)\\}/$', views.function_view,
+                name='item')])]
+        index = UrlResolver.build_reverse_index(
+            UrlResolver.compile_patterns(urlpatterns))
+        self.assertEqual(index['item'].reverse((), {'pk': 1}),
+                         '/{a}/item{1}/')
+        with self.assertRaises(NoReverseMatch):
+            index['item'].reverse((), {'pk': 'x'})
+
+    def testReverseMemoized(self):
+        for _ in range(3):
+            self.resolver.reverse('test_args', args=(1, 'a'))
+        info = self.resolver.reverse_cache.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, 1))
+
+    def testNoReverseMatch(self):
+        with self.assertRaises(NoReverseMatch):
+            self.resolver.reverse('nonexistent')
+        with self.assertRaises(NoReverseMatch):
+            self.resolver.reverse('test_args', args=('abc', 'val'))
+        with self.assertRaises(NoReverseMatch):
+            # mixed positional and named groups
+            self.resolver.reverse('test_args_kwargs', args=(1,),
+                                  kwargs={'kwarg': 'a'})
+
+    def testGlobalReverse(self):
+        self.assertEqual(reverse('function'), '/function/')
+
+
+class UrlResolverCacheTestCase(DvasyaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.resolver = UrlResolver(root_urlconf='testapp.urls')
+
+    def testCacheHits(self):
+        match = self.resolver.lookup('function/')
+        self.assertIs(match[0], views.function_view)
+        self.assertEqual(self.resolver.lookup('function/'), match)
+        info = self.resolver.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+    def testNegativeCache(self):
+        for _ in range(2):
+            with self.assertRaises(HttpResponseNotFound):
+                self.resolver.lookup('nomatch/')
+        info = self.resolver.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+    def testRebuildInvalidatesCache(self):
+        self.resolver.lookup('function/')
+        self.resolver.build()
+        self.assertEqual(self.resolver.cache_info().currsize, 0)
+
+    @override_settings(URL_RESOLVER_CACHE_SIZE=0)
+    def testCacheDisabled(self):
+        resolver = UrlResolver(root_urlconf='testapp.urls')
+        self.assertIsNone(resolver.cache_info())
+        match = resolver.lookup('function/')
+        self.assertIs(match[0], views.function_view)
+
 
 class DvasyaResponseTestCase(DvasyaServerTestCaseBase):
     def testJSONResponse(self):
@@ -175,6 +462,1096 @@ class DvasyaResponseTestCase(DvasyaServerTestCaseBase):
         self.assertIn("raise effect", result.text)
 
 
+class MiddlewareChainTestCase(DvasyaServerTestCaseBase):
+    def setUp(self):
+        super().setUp()
+        with override_settings(DVASYA_MIDDLEWARES=[
+                'dvasya.middleware.RequestProxyMiddleware',
+                'testapp.middleware.OuterMiddleware',
+                'testapp.middleware.NoopMiddleware',
+                'testapp.middleware.ShortcutMiddleware',
+                'testapp.middleware.ExceptionMiddleware']):
+            self.client.middlewares = load_middlewares()
+
+    def testChainLoaded(self):
+        middlewares = self.client.middlewares
+        self.assertEqual(len(middlewares), 2)
+        chain = middlewares[1].__self__
+        self.assertIsInstance(chain, MiddlewareChain)
+        noop_hooks = chain.hooks[1]
+        self.assertEqual(noop_hooks, (None, None, None))
+        shortcut_hooks = chain.hooks[2]
+        self.assertTrue(shortcut_hooks.process_request[1])
+        self.assertIsNone(shortcut_hooks.process_exception)
+
+    def testResponseHooks(self):
+        result = self.client.get('/function/')
+        self.assertFunctionViewOK(self.expected, result)
+        self.assertEqual(result.headers['X-Middlewares'], 'shortcut;outer;')
+
+    def testRequestShortcut(self):
+        result = self.client.get('/function/?shortcut=1')
+        self.assertFalse(self.mock.called)
+        self.assertEqual(result.text, 'shortcut')
+        self.assertEqual(result.headers['X-Middlewares'], 'shortcut;outer;')
+
+    def testProcessException(self):
+        with mock.patch("testapp.views.patched_function_view",
+                        side_effect=ValueError("WTF")):
+            result = self.client.get('/function/?teapot=1')
+            self.assertEqual(result.status, 418)
+            self.assertEqual(result.text, 'WTF')
+            self.assertEqual(result.headers['X-Middlewares'],
+                             'shortcut;outer;')
+
+            result = self.client.get('/function/')
+            self.assertEqual(result.status, 500)
+            self.assertIn("raise effect", result.text)
+            self.assertEqual(result.headers['X-Middlewares'],
+                             'shortcut;outer;')
+
+
+@override_settings(INSTRUMENTATION=True)
+class InstrumentationTestCase(DvasyaServerTestCaseBase):
+    def setUp(self):
+        super().setUp()
+        with override_settings(INSTRUMENTATION=True):
+            self.client.middlewares = load_middlewares()
+        timings.clear()
+
+    def tearDown(self):
+        timings.clear()
+        super().tearDown()
+
+    def testRouteTimings(self):
+        result = self.client.get('/function/')
+        self.assertFunctionViewOK(self.expected, result)
+        snapshot = timings.snapshot()
+        self.assertEqual(list(snapshot), ['function'])
+        stages = snapshot['function']
+        self.assertEqual(
+            set(stages),
+            {'resolve', 'view', 'middleware:RequestProxyMiddleware'})
+        for summary in stages.values():
+            self.assertEqual(summary['count'], 1)
+        self.assertGreaterEqual(
+            stages['middleware:RequestProxyMiddleware']['max'],
+            stages['view']['max'])
+
+    def testUnnamedRoute(self):
+        self.client.get('/include/test_include/')
+        self.assertIn('^include/ ^test_include/$', timings.snapshot())
+
+    def testRejectedBody(self):
+        with override_settings(MAX_BODY_SIZE=4):
+            result = self.client.post('/function/', body=b'arg=1')
+        self.assertEqual(result.status, 413)
+        snapshot = timings.snapshot()
+        self.assertEqual(list(snapshot), ['function'])
+        self.assertEqual(list(snapshot['function']), ['resolve'])
+
+    def testNotFound(self):
+        self.client.get('/nomatch/')
+        snapshot = timings.snapshot()
+        self.assertEqual(list(snapshot[NOT_FOUND_ROUTE]), ['resolve'])
+
+    def testDisabled(self):
+        with override_settings(INSTRUMENTATION=False):
+            self.client.middlewares = load_middlewares()
+            self.client.get('/function/')
+        self.assertEqual(timings.snapshot(), {})
+
+    def testHistogram(self):
+        histogram = Histogram()
+        for value in (0.000001, 0.001, 0.002, 0.5):
+            histogram.add(value)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 4)
+        self.assertEqual(summary['max'], 0.5)
+        self.assertLessEqual(summary['p50'], 0.001024)
+        self.assertEqual(summary['p99'], 0.5)
+
+
+class RouteTimingsTestCase(DvasyaTestCase):
+    def tearDown(self):
+        timings.clear()
+        super(RouteTimingsTestCase, self).tearDown()
+
+    def get_timings(self, *values):
+        result = Timings()
+        for value in values:
+            result.record('function', 'view', value)
+        return result
+
+    def testMerge(self):
+        merged = Timings()
+        merged.merge(self.get_timings(0.001, 0.002).dump())
+        merged.merge(json.loads(json.dumps(self.get_timings(0.5).dump())))
+        summary = merged.snapshot()['function']['view']
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['max'], 0.5)
+        self.assertAlmostEqual(summary['mean'], 0.503 / 3)
+        self.assertLessEqual(summary['p50'], 0.002048)
+
+    def testReportTimings(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        process = ChildProcess(0, 0, mock.Mock(stats_interval=0.01,
+                                               max_requests=0), [])
+        process.loop = loop
+        process.writer = mock.Mock()
+        timings.record('function', 'view', 0.001)
+        with self.assertRaises(asyncio.TimeoutError):
+            loop.run_until_complete(asyncio.wait_for(
+                process.report_timings(), 0.05, loop=loop))
+        message = process.writer.send.call_args[0][0]
+        self.assertTrue(message.startswith('timings '))
+        self.assertEqual(json.loads(message[len('timings '):]),
+                         timings.dump())
+
+    def testSupervisorStats(self):
+        supervisor = Supervisor(mock.Mock(pidfile='test.pid'))
+        for pid, values in ((1, (0.001, 0.002)), (2, (0.5,))):
+            worker = Worker.__new__(Worker)
+            worker.pid = pid
+            worker.handle_message('timings %s' % json.dumps(
+                self.get_timings(*values).dump()))
+            supervisor.workers[pid] = worker
+        # invalid frame doesn't replace previous timings
+        worker.handle_message('timings {"function": {"view": {}}}')
+        stats = supervisor.get_stats()
+        self.assertEqual(stats['routes']['function']['view']['count'], 3)
+        with tempfile.TemporaryDirectory() as tmp:
+            supervisor.args.stats_file = os.path.join(tmp, 'stats.json')
+            supervisor.write_stats(stats)
+            with open(supervisor.args.stats_file) as f:
+                data = json.load(f)
+        self.assertEqual(data['routes'], stats['routes'])
+
+
+class WorkerStatsTestCase(DvasyaTestCase):
+    def testPackUnpack(self):
+        stats = WorkerStats(served=10, in_flight=2, loop_lag=0.5,
+                            rss=2 ** 30, errors=1, accepted=3, busy=0.25)
+        frame = stats.pack()
+        self.assertIsInstance(frame, bytes)
+        self.assertEqual(WorkerStats.unpack(frame), stats)
+
+    def testInvalidFrame(self):
+        with self.assertRaises(struct.error):
+            WorkerStats.unpack(b'123')
+
+    def testAggregate(self):
+        total = WorkerStats.aggregate([
+            WorkerStats(10, 1, 0.25, 100, 1, 5, 0.25),
+            WorkerStats(20, 2, 0.5, 200, 0, 7, 0.5),
+        ])
+        self.assertEqual(total, WorkerStats(30, 3, 0.5, 300, 1, 12, 0.75))
+        self.assertEqual(WorkerStats.aggregate([]).served, 0)
+
+
+class LoopLagMonitorTestCase(DvasyaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.monitor = LoopLagMonitor(self.loop, 0.01, 0.05)
+
+    def tearDown(self):
+        self.monitor.stop()
+        if self.monitor.task is not None:
+            with self.assertRaises(asyncio.CancelledError):
+                self.loop.run_until_complete(self.monitor.task)
+        self.loop.close()
+        super().tearDown()
+
+    @asyncio.coroutine
+    def block_loop(self):
+        yield from asyncio.sleep(0.05, loop=self.loop)
+        time.sleep(0.2)
+        yield from asyncio.sleep(0.05, loop=self.loop)
+
+    def testBlockedLoop(self):
+        self.monitor.start()
+        with self.assertLogs('dvasya.worker', 'WARNING') as logs:
+            self.loop.run_until_complete(self.block_loop())
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('in block_loop', logs.output[0])
+        self.assertGreaterEqual(self.monitor.take_max_lag(), 0.15)
+        self.assertEqual(self.monitor.take_max_lag(), 0.0)
+        self.assertGreater(self.monitor.histogram.count, 1)
+
+
+class MemoryUsageTestCase(DvasyaTestCase):
+    def testCurrentProcess(self):
+        usage = get_memory_usage(os.getpid())
+        if usage is None:
+            self.skipTest("/proc is not available")
+        unique, shared = usage
+        self.assertGreater(unique, 0)
+        self.assertGreaterEqual(shared, 0)
+
+    def testNoProcess(self):
+        self.assertIsNone(get_memory_usage('nonexistent'))
+
+
+class CpuListTestCase(DvasyaTestCase):
+    def testParseCpuList(self):
+        self.assertEqual(parse_cpu_list('0-3,8,10-11\n'),
+                         [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(parse_cpu_list('5'), [5])
+        self.assertEqual(parse_cpu_list(''), [])
+
+
+class EventLoopPolicyTestCase(DvasyaTestCase):
+    def tearDown(self):
+        asyncio.set_event_loop_policy(None)
+        super(EventLoopPolicyTestCase, self).tearDown()
+
+    def testSetPolicy(self):
+        logger = mock.Mock()
+        policy = set_event_loop_policy('asyncio.DefaultEventLoopPolicy',
+                                       logger)
+        self.assertIs(asyncio.get_event_loop_policy(), policy)
+        self.assertIsNone(set_event_loop_policy(None, logger))
+        self.assertIs(asyncio.get_event_loop_policy(), policy)
+        self.assertFalse(logger.warning.called)
+
+    def testFallback(self):
+        logger = mock.Mock()
+        policy = asyncio.get_event_loop_policy()
+        paths = ('nonexistent.EventLoopPolicy', 'asyncio.Nonexistent',
+                 'uvloop', 'os.getcwd', 'collections.OrderedDict')
+        for path in paths:
+            self.assertIsNone(set_event_loop_policy(path, logger))
+        self.assertIs(asyncio.get_event_loop_policy(), policy)
+        self.assertEqual(logger.warning.call_count, len(paths))
+
+
+class ListenAddressTestCase(DvasyaTestCase):
+    def testParseAddress(self):
+        self.assertEqual(parse_address('unix:/tmp/dvasya.sock'),
+                         '/tmp/dvasya.sock')
+        self.assertEqual(parse_address('127.0.0.1:8000'),
+                         ('127.0.0.1', 8000))
+        self.assertEqual(parse_address('[::1]:8000'), ('::1', 8000))
+        self.assertEqual(parse_address('8000'), ('', 8000))
+        self.assertRaises(ValueError, parse_address, 'localhost')
+
+    def testUnixSocket(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dvasya.sock')
+            # stale socket file is replaced
+            for _ in range(2):
+                sock = bind_socket(path, backlog=16)
+                self.assertEqual(sock.family, socket.AF_UNIX)
+                self.assertEqual(sock.getsockname(), path)
+                sock.close()
+
+
+class ReusePortTestCase(DvasyaTestCase):
+    def setUp(self):
+        super(ReusePortTestCase, self).setUp()
+        probe = bind_socket(('127.0.0.1', 0))
+        self.address = probe.getsockname()
+        probe.close()
+        self.supervisor = Supervisor(mock.Mock(
+            pidfile='test.pid', bind=None, host=self.address[0],
+            port=self.address[1], reuse_port=True, backlog=16))
+
+    def assertSharedSocket(self):
+        with self.assertLogs('dvasya.supervisor', 'WARNING'):
+            listeners = self.supervisor.open_sockets()
+        [(address, sock)] = listeners
+        self.addCleanup(sock.close)
+        self.assertEqual(address, self.address)
+        self.assertEqual(sock.getsockname(), self.address)
+
+    def testNoReusePort(self):
+        attrs = dict(vars(socket))
+        attrs.pop('SO_REUSEPORT', None)
+        module = types.SimpleNamespace(**attrs)
+        with mock.patch('dvasya.server.socket', module):
+            self.assertSharedSocket()
+
+    def testProbeFailed(self):
+        def bind(address, reuse_port=False, backlog=1024):
+            if reuse_port:
+                raise OSError("Protocol not available")
+            return bind_socket(address, backlog=backlog)
+
+        with mock.patch('dvasya.server.bind_socket', side_effect=bind):
+            self.assertSharedSocket()
+
+    def testWorkersBindSockets(self):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            self.skipTest("SO_REUSEPORT is not supported")
+        listeners = self.supervisor.open_sockets()
+        self.assertEqual(listeners, [(self.address, None)])
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        processes = []
+        for _ in range(2):
+            process = ChildProcess(0, 0, mock.Mock(
+                max_requests=0, backlog=16), listeners)
+            process.loop = loop
+            loop.run_until_complete(
+                process.create_servers(web.Application(loop=loop)))
+            [server] = process.servers
+            self.addCleanup(server.close)
+            [sock] = server.sockets
+            self.assertEqual(sock.getsockname(), self.address)
+            self.assertTrue(sock.getsockopt(socket.SOL_SOCKET,
+                                            socket.SO_REUSEPORT))
+            processes.append(process)
+
+        # kernel balances connections between workers sockets
+        connections = [loop.run_until_complete(asyncio.open_connection(
+            *self.address, loop=loop)) for _ in range(4)]
+        loop.run_until_complete(asyncio.sleep(0.05, loop=loop))
+        self.assertEqual(sum(p.accepted for p in processes), 4)
+        for _, writer in connections:
+            writer.close()
+        for process in processes:
+            for handler in process.handlers.values():
+                loop.run_until_complete(handler.finish_connections(0.1))
+
+
+class DrainTestCase(DvasyaTestCase):
+    def setUp(self):
+        super(DrainTestCase, self).setUp()
+        self.loop = loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        sock = bind_socket(('127.0.0.1', 0), backlog=16)
+        self.address = sock.getsockname()
+        self.process = ChildProcess(0, 0, mock.Mock(
+            max_requests=0, backlog=16), [(self.address, sock)])
+        self.process.loop = loop
+        self.process.drain_delay = 0.01
+        self.process.writer = mock.Mock()
+        self.release = asyncio.Event(loop=loop)
+
+        @asyncio.coroutine
+        def view(request):
+            yield from self.release.wait()
+            return web.Response(text='done')
+
+        app = web.Application(loop=loop,
+                              middlewares=[self.process.track_requests])
+        app.router.add_route('GET', '/', view)
+        loop.run_until_complete(self.process.create_servers(app))
+        [self.server] = self.process.servers
+        self.addCleanup(self.server.close)
+
+        # record order of stopping accepting and closing server
+        self.calls = calls = []
+        remove_reader = loop.remove_reader
+        close = self.server.close
+        loop.remove_reader = lambda fd: (calls.append('remove_reader'),
+                                         remove_reader(fd))[1]
+        self.server.close = lambda: (calls.append('close'), close())[1]
+
+    def request(self):
+        reader, writer = self.loop.run_until_complete(
+            asyncio.open_connection(*self.address, loop=self.loop))
+        self.addCleanup(writer.close)
+        writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        while not self.process.in_flight:
+            self.loop.run_until_complete(asyncio.sleep(0.01, loop=self.loop))
+        return reader
+
+    def shutdown(self, graceful_timeout):
+        self.process.args.graceful_timeout = graceful_timeout
+        asyncio.async(self.process.shutdown(), loop=self.loop)
+        # shutdown stops loop after drain
+        self.loop.run_forever()
+        self.assertEqual(self.calls, ['remove_reader', 'close'])
+
+    def testDrained(self):
+        reader = self.request()
+        self.loop.call_later(0.05, self.release.set)
+        self.shutdown(graceful_timeout=1)
+        self.process.writer.send.assert_called_once_with('drained 1 0')
+        response = self.loop.run_until_complete(reader.read())
+        self.assertTrue(response.endswith(b'done'))
+        self.assertEqual(self.process.in_flight, 0)
+
+    def testAborted(self):
+        self.request()
+        self.shutdown(graceful_timeout=0.05)
+        self.process.writer.send.assert_called_once_with('drained 0 1')
+        self.assertEqual(self.process.in_flight, 0)
+
+
+class RecycleRequestTestCase(DvasyaTestCase):
+    def get_process(self, **kwargs):
+        args = mock.Mock(max_requests=0, max_requests_jitter=0, max_rss=0)
+        args.configure_mock(**kwargs)
+        process = ChildProcess(0, 0, args, [])
+        process.loop = asyncio.new_event_loop()
+        self.addCleanup(process.loop.close)
+        process.writer = mock.Mock()
+        return process
+
+    def serve(self, process, count):
+        @asyncio.coroutine
+        def view(request):
+            return Response(text='ok')
+
+        handler = process.loop.run_until_complete(
+            process.track_requests(None, view))
+        for _ in range(count):
+            process.loop.run_until_complete(handler(mock.Mock()))
+
+    def testMaxRequests(self):
+        with mock.patch('dvasya.server.random.randint',
+                        return_value=2) as randint:
+            process = self.get_process(max_requests=3, max_requests_jitter=2)
+        randint.assert_called_once_with(0, 2)
+        self.assertEqual(process.max_requests, 5)
+
+        self.serve(process, 4)
+        self.assertFalse(process.writer.send.called)
+        self.serve(process, 3)
+        process.writer.send.assert_called_once_with(
+            'recycle 5 requests served')
+
+    def testMaxRss(self):
+        process = self.get_process(max_rss=100)
+        process.check_memory(50 * 2 ** 20)
+        self.assertFalse(process.writer.send.called)
+        process.check_memory(150 * 2 ** 20)
+        process.check_memory(200 * 2 ** 20)
+        process.writer.send.assert_called_once_with(
+            'recycle resident memory 150.0 MB')
+
+        # recycling is requested once whatever the reason is
+        process.max_requests = 1
+        self.serve(process, 1)
+        self.assertEqual(process.writer.send.call_count, 1)
+
+    def testDisabled(self):
+        process = self.get_process()
+        self.assertEqual(process.max_requests, 0)
+        self.serve(process, 3)
+        process.check_memory(2 ** 40)
+        self.assertFalse(process.writer.send.called)
+
+
+class AutoscalerTestCase(DvasyaTestCase):
+    def setUp(self):
+        super(AutoscalerTestCase, self).setUp()
+        self.autoscaler = Autoscaler(min_workers=1, max_workers=3, now=0)
+        self.now = Autoscaler.cooldown
+
+    def get_workers(self, *loads):
+        """ Returns workers with (busy, in_flight) loads."""
+        return [mock.Mock(stats=WorkerStats(0, in_flight, 0.0, 0, 0, 0, busy),
+                          replacing=False) for busy, in_flight in loads]
+
+    def sample(self, workers, count=Autoscaler.samples):
+        decisions = []
+        for _ in range(count):
+            decisions.append(self.autoscaler.sample(workers, self.now))
+            self.now += 1
+        return decisions
+
+    def testScaleUp(self):
+        workers = self.get_workers((0.9, 0), (0.8, 2))
+        decisions = self.sample(workers)
+        self.assertEqual(decisions[-1], (1, None))
+        self.assertEqual(decisions[:-1], [(0, None)] * 2)
+        self.assertAlmostEqual(self.autoscaler.busy, 0.85)
+
+        # requests in flight trigger scaling too
+        self.now += Autoscaler.cooldown
+        workers = self.get_workers((0.1, 10), (0.1, 8))
+        self.assertEqual(self.sample(workers)[-1], (1, None))
+
+        # pool is not scaled above max_workers
+        self.now += Autoscaler.cooldown
+        workers = self.get_workers(*[(0.9, 0)] * 3)
+        self.assertEqual(self.sample(workers, 10), [(0, None)] * 10)
+
+    def testScaleDown(self):
+        workers = self.get_workers((0.1, 0), (0.1, 0), (0.0, 0))
+        # workers being recycled are already replaced
+        workers[0].replacing = True
+        decisions = self.sample(workers)
+        self.assertEqual(decisions[:-1], [(0, None)] * 2)
+        self.assertEqual(decisions[-1], (-1, workers[1]))
+
+        # pool is not scaled below min_workers
+        self.now += Autoscaler.cooldown
+        self.assertEqual(self.sample(workers[2:], 10), [(0, None)] * 10)
+
+        # no worker to stop
+        for worker in workers:
+            worker.replacing = True
+        self.assertEqual(self.sample(workers, 10), [(0, None)] * 10)
+
+    def testNoFlap(self):
+        high = self.get_workers((0.9, 0), (0.9, 0))
+        low = self.get_workers((0.0, 0), (0.0, 0))
+        # load must stay high or low for consecutive samples
+        decisions = self.sample(high, 2) + self.sample(low, 2) + \
+            self.sample(high, 2) + self.sample(self.get_workers(
+                (0.5, 0), (0.5, 0)))
+        self.assertEqual(decisions, [(0, None)] * 9)
+        self.assertEqual(self.sample(high)[-1], (1, None))
+
+        # no scaling during cooldown after previous scaling
+        decisions = self.sample(low, Autoscaler.cooldown - 1)
+        self.assertEqual(decisions, [(0, None)] * (Autoscaler.cooldown - 1))
+        self.assertEqual(self.sample(low, 1), [(-1, low[0])])
+
+        # samples are forgotten on reset, i.e. during reload
+        self.now += Autoscaler.cooldown
+        self.sample(high, 2)
+        self.autoscaler.reset()
+        self.assertEqual(self.sample(high, 2), [(0, None)] * 2)
+
+
+class CpuAffinityTestCase(DvasyaTestCase):
+    def setUp(self):
+        super(CpuAffinityTestCase, self).setUp()
+        self.supervisor = Supervisor(mock.Mock(pidfile='test.pid',
+                                               cpu_affinity='auto'))
+        for name, value in (('sched_getaffinity', {0, 1, 2, 5}),
+                            ('sched_setaffinity', None)):
+            patcher = mock.patch('dvasya.server.os.%s' % name, create=True,
+                                 return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('dvasya.server.get_numa_nodes',
+                             return_value=[[0, 1, 2, 3], [4, 5], [6, 7]])
+        self.get_numa_nodes = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testAuto(self):
+        self.assertEqual(self.supervisor.get_cpu_sets(),
+                         [{0}, {1}, {2}, {5}])
+
+    def testNuma(self):
+        self.supervisor.args.cpu_affinity = 'numa'
+        # only CPUs available to supervisor are used, node without them is
+        # skipped
+        self.assertEqual(self.supervisor.get_cpu_sets(), [{0, 1, 2}, {5}])
+
+    def testNoNumaTopology(self):
+        self.supervisor.args.cpu_affinity = 'numa'
+        self.get_numa_nodes.return_value = []
+        with self.assertLogs('dvasya.supervisor', 'WARNING'):
+            cpu_sets = self.supervisor.get_cpu_sets()
+        self.assertEqual(cpu_sets, [{0}, {1}, {2}, {5}])
+
+    def testDisabled(self):
+        self.supervisor.args.cpu_affinity = None
+        self.assertIsNone(self.supervisor.get_cpu_sets())
+
+    def testReusedBySlot(self):
+        supervisor = self.supervisor
+        supervisor.cpu_sets = supervisor.get_cpu_sets()
+        supervisor.loop = mock.Mock()
+
+        def worker_class(loop, args, listeners, slot, cpus, **kwargs):
+            return mock.Mock(pid=100 + slot, slot=slot, cpus=cpus)
+
+        supervisor.worker_class = worker_class
+        workers = [supervisor.spawn_worker() for _ in range(6)]
+        self.assertEqual([w.cpus for w in workers],
+                         [{0}, {1}, {2}, {5}, {0}, {1}])
+        # worker replacement is pinned to the same CPUs
+        self.assertEqual(supervisor.spawn_worker(slot=2).cpus, {2})
+
+
+class RestartPolicyTestCase(DvasyaTestCase):
+    def setUp(self):
+        super(RestartPolicyTestCase, self).setUp()
+        args = mock.Mock(pidfile='test.pid', max_restarts=2,
+                         restart_window=60)
+        self.supervisor = Supervisor(args)
+        self.supervisor.loop = mock.Mock()
+        self.supervisor.stop = mock.Mock()
+
+    def crash(self, pid, slot=0, uptime=1):
+        worker = mock.Mock(pid=pid, slot=slot,
+                           started_at=time.monotonic() - uptime)
+        self.supervisor.workers[pid] = worker
+        self.supervisor.restart_worker(worker, signal.SIGKILL)
+        self.supervisor.pending_restarts.pop(worker, None)
+        return worker
+
+    def delays(self):
+        calls = self.supervisor.loop.call_later.call_args_list
+        return [c[0][0] for c in calls]
+
+    def testBackoff(self):
+        self.supervisor.args.max_restarts = 0
+        for pid in range(1, 5):
+            self.crash(pid)
+        self.crash(5, slot=1)
+        self.crash(6, uptime=3600)
+        self.assertEqual(self.delays(), [0, 0.5, 1.0, 2.0, 0, 0])
+        self.assertEqual(self.supervisor.workers, {})
+        self.assertFalse(self.supervisor.stop.called)
+
+    def testCrashLoop(self):
+        self.crash(1)
+        self.crash(2, slot=1)
+        self.assertFalse(self.supervisor.stop.called)
+        self.crash(3)
+        self.assertTrue(self.supervisor.stop.called)
+        self.assertEqual(self.supervisor.exit_code, 1)
+        self.assertEqual(len(self.delays()), 2)
+
+
+class ReloadTestCase(DvasyaTestCase):
+    def setUp(self):
+        super(ReloadTestCase, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        args = mock.Mock(pidfile='test.pid', preload=False, max_restarts=0,
+                         graceful_timeout=0.1, reload_batch=1)
+        self.supervisor = Supervisor(args)
+        self.supervisor.loop = self.loop
+        # workers become ready when connected
+        self.auto_ready = True
+        self.stopped = []
+        pids = iter(range(100, 200))
+        for patcher in (
+                mock.patch('dvasya.server.os.fork',
+                           side_effect=lambda: next(pids)),
+                mock.patch('dvasya.server.os.pipe', return_value=(0, 0)),
+                mock.patch('dvasya.server.os.close'),
+                mock.patch.object(Worker, 'connect', autospec=True,
+                                  side_effect=self.connect),
+                mock.patch.object(Worker, 'stop', autospec=True,
+                                  side_effect=self.stop)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        # run scheduled connect tasks
+        self.loop.run_until_complete(asyncio.sleep(0, loop=self.loop))
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        super(ReloadTestCase, self).tearDown()
+
+    @asyncio.coroutine
+    def connect(self, worker, pid, up_write, down_read):
+        if self.auto_ready:
+            worker.handle_message('ready')
+
+    def stop(self, worker, timeout):
+        self.stopped.append(worker)
+        worker.retiring = True
+        return asyncio.sleep(0, loop=self.loop)
+
+    def run_loop(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def live_workers(self):
+        return [w for w in self.supervisor.workers.values()
+                if not w.retiring]
+
+    def testReplaceRespawned(self):
+        old = self.supervisor.spawn_worker()
+        self.auto_ready = False
+        task = asyncio.async(self.supervisor.replace_workers([old]),
+                             loop=self.loop)
+        self.run_loop(asyncio.sleep(0.01, loop=self.loop))
+        new = self.supervisor.workers[101]
+        # new worker crashes before it gets ready and is restarted
+        self.supervisor.restart_worker(new, signal.SIGKILL)
+        self.run_loop(asyncio.sleep(0.01, loop=self.loop))
+        self.assertEqual(new.pid, 102)
+        new.handle_message('ready')
+        self.assertTrue(self.run_loop(task))
+        self.assertEqual(self.stopped, [old])
+
+    def testReplaceTimeout(self):
+        old = self.supervisor.spawn_worker()
+        self.auto_ready = False
+        self.assertFalse(self.run_loop(self.supervisor.replace_workers([old])))
+        new = self.supervisor.workers[101]
+        self.assertEqual(self.stopped, [new])
+        self.assertFalse(old.retiring)
+
+    def testReplaceTimeoutRestarting(self):
+        old = self.supervisor.spawn_worker()
+        self.auto_ready = False
+        self.supervisor.restart_delay = 1
+        task = asyncio.async(self.supervisor.replace_workers([old]),
+                             loop=self.loop)
+        self.run_loop(asyncio.sleep(0.01, loop=self.loop))
+        new = self.supervisor.workers[101]
+        # first restart is immediate, second one is delayed
+        self.supervisor.restart_worker(new, signal.SIGKILL)
+        self.run_loop(asyncio.sleep(0.01, loop=self.loop))
+        self.supervisor.restart_worker(new, signal.SIGKILL)
+        self.assertFalse(self.run_loop(task))
+        self.assertEqual(self.stopped, [])
+        self.assertTrue(new.retiring)
+        # pending restart does nothing
+        self.supervisor.pending_restarts[new]._run()
+        self.assertEqual(list(self.supervisor.workers), [old.pid])
+
+    def testRestartSameSlot(self):
+        old = self.supervisor.spawn_worker()
+        # replacement is started in the slot of replaced worker
+        new = self.supervisor.spawn_worker(slot=old.slot)
+        self.supervisor.restart_delay = 0.01
+        for worker in (old, new):
+            self.supervisor.restart_worker(worker, signal.SIGKILL)
+        self.assertEqual(set(self.supervisor.pending_restarts), {old, new})
+        self.run_loop(asyncio.sleep(0.05, loop=self.loop))
+        self.assertEqual(self.supervisor.pending_restarts, {})
+        self.assertEqual(set(self.live_workers()), {old, new})
+
+        for worker in (old, new):
+            self.supervisor.restart_worker(worker, signal.SIGKILL)
+        self.supervisor.cancel_restarts()
+        self.run_loop(asyncio.sleep(0.05, loop=self.loop))
+        self.assertEqual(self.supervisor.workers, {})
+
+    def testReloadSkipsRemovedWorkers(self):
+        workers = [self.supervisor.spawn_worker() for _ in range(3)]
+        task = asyncio.async(self.supervisor.rolling_reload(),
+                             loop=self.loop)
+        self.run_loop(asyncio.sleep(0, loop=self.loop))
+        # while first worker is replaced, second one is scaled down and
+        # third one exits
+        workers[1].retiring = True
+        del self.supervisor.workers[workers[2].pid]
+        self.run_loop(task)
+        self.assertEqual(self.stopped, [workers[0]])
+        self.assertEqual(sorted(self.supervisor.workers),
+                         [w.pid for w in workers[:2]] + [103])
+
+    def testRecycleDuringReload(self):
+        self.supervisor.recycle_semaphore = asyncio.Semaphore(
+            1, loop=self.loop)
+        workers = [self.supervisor.spawn_worker() for _ in range(2)]
+        reload = asyncio.async(self.supervisor.rolling_reload(),
+                               loop=self.loop)
+        self.run_loop(asyncio.sleep(0, loop=self.loop))
+        # worker being replaced by reload asks for recycling
+        self.run_loop(self.supervisor.recycle_worker(workers[0]))
+        self.run_loop(reload)
+        self.assertEqual(self.stopped, workers)
+        self.assertEqual(len(self.live_workers()), 2)
+
+    def testReloadDuringRecycle(self):
+        self.supervisor.recycle_semaphore = asyncio.Semaphore(
+            1, loop=self.loop)
+        workers = [self.supervisor.spawn_worker() for _ in range(2)]
+        recycle = asyncio.async(self.supervisor.recycle_worker(workers[0]),
+                                loop=self.loop)
+        self.run_loop(asyncio.sleep(0, loop=self.loop))
+        # worker being recycled is not replaced by reload
+        self.run_loop(self.supervisor.rolling_reload())
+        self.run_loop(recycle)
+        self.assertEqual(len(set(self.stopped)), len(self.stopped))
+        self.assertIn(workers[0], self.stopped)
+        self.assertEqual(len(self.live_workers()), 2)
+
+
+class LoadApplicationTestCase(DvasyaTestCase):
+    def setUp(self):
+        super(LoadApplicationTestCase, self).setUp()
+        self.supervisor = Supervisor(mock.Mock(pidfile='test.pid',
+                                               preload=False))
+        patcher = mock.patch.object(ChildProcess, 'load_application')
+        self.load = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testLoadedInChildProcess(self):
+        self.assertTrue(self.supervisor.load_application())
+        # application is not imported by supervisor, so workers started on
+        # reload load new code
+        self.assertFalse(self.load.called)
+
+        self.load.side_effect = UrlConfError("invalid urlconf")
+        with mock.patch.object(self.supervisor, 'logger'):
+            self.assertFalse(self.supervisor.load_application())
+        self.load.side_effect = SyntaxError("invalid syntax")
+        with mock.patch.object(self.supervisor, 'logger'):
+            self.assertFalse(self.supervisor.load_application())
+        self.assertFalse(self.load.called)
+
+    def testPreload(self):
+        self.supervisor.args.preload = True
+        self.assertTrue(self.supervisor.load_application())
+        self.load.assert_called_once_with()
+
+        self.load.side_effect = UrlConfError("invalid urlconf")
+        with self.assertLogs('dvasya.supervisor', 'ERROR'):
+            self.assertFalse(self.supervisor.load_application())
+
+    def testReloadInvalidApplication(self):
+        self.load.side_effect = UrlConfError("invalid urlconf")
+        with mock.patch.object(self.supervisor, 'rolling_reload') as reload:
+            with mock.patch.object(self.supervisor, 'logger'):
+                self.supervisor.reload()
+        self.assertFalse(reload.called)
+
+
+class WorkerTestCase(DvasyaTestCase):
+    def setUp(self):
+        super(WorkerTestCase, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        for patcher in (
+                mock.patch('dvasya.server.os.fork', return_value=100),
+                mock.patch('dvasya.server.os.pipe', return_value=(0, 0)),
+                mock.patch('dvasya.server.os.close'),
+                mock.patch.object(Worker, 'connect', autospec=True,
+                                  side_effect=asyncio.coroutine(
+                                      lambda *args: None))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.worker = Worker(self.loop, mock.Mock(preload=False), [])
+
+    def tearDown(self):
+        # run scheduled connect tasks
+        self.loop.run_until_complete(asyncio.sleep(0, loop=self.loop))
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        super(WorkerTestCase, self).tearDown()
+
+    def testNotConnected(self):
+        def kill(pid, sig):
+            self.worker.exited.set_result(pid)
+
+        with mock.patch('dvasya.server.os.kill', side_effect=kill) as m:
+            self.loop.run_until_complete(self.worker.stop(1))
+        m.assert_called_once_with(100, signal.SIGKILL)
+        self.assertTrue(self.worker.retiring)
+
+    def testExited(self):
+        self.worker.exited.set_result(100)
+        with mock.patch('dvasya.server.os.kill') as m:
+            self.loop.run_until_complete(self.worker.stop(1))
+        self.assertFalse(m.called)
+
+    @mock.patch('dvasya.server.unfreeze_heap')
+    @mock.patch('dvasya.server.freeze_heap')
+    def testPreloadHeapUnfrozen(self, freeze, unfreeze):
+        self.worker.close()
+        self.worker.args.preload = True
+        self.worker.start()
+        # heap is frozen for forked child only
+        self.assertTrue(freeze.called)
+        self.assertTrue(unfreeze.called)
+
+
+class RequestProxyTestCase(DvasyaTestCase):
+    def get_proxy(self, headers=(), peername=('127.0.0.1', 12345)):
+        transport = mock.Mock()
+        transport.get_extra_info.return_value = peername
+        request = mock.Mock(method='GET', path='/path/',
+                            headers=CIMultiDict(headers),
+                            transport=transport)
+        return DvasyaRequestProxy(request)
+
+    def testAttributes(self):
+        proxy = self.get_proxy()
+        self.assertEqual(proxy.method, 'GET')
+        self.assertEqual(proxy.path, '/path/')
+        self.assertEqual(proxy.POST, {})
+        self.assertIs(proxy.version, proxy._request.version)
+        proxy.user = 'user'
+        self.assertEqual(proxy.user, 'user')
+        self.assertRaises(AttributeError, copy.copy(proxy).__getattr__,
+                          '_request')
+
+    def testMeta(self):
+        proxy = self.get_proxy([('X-Real-IP', '127.0.0.2'),
+                                ('X_Skipped', '1'),
+                                ('Accept', 'text/html'),
+                                ('Accept', 'text/plain')])
+        meta = proxy.META
+        self.assertEqual(meta['X_REAL_IP'], '127.0.0.2')
+        self.assertEqual(meta['ACCEPT'], 'text/plain')
+        self.assertEqual(meta['REMOTE_ADDR'], '127.0.0.1')
+        self.assertEqual(meta['REMOTE_PORT'], 12345)
+        self.assertNotIn('X_SKIPPED', meta)
+        self.assertNotIn('X-REAL-IP', meta)
+        self.assertIsNone(meta.get('x_real_ip'))
+        self.assertEqual(
+            list(meta),
+            ['REMOTE_ADDR', 'REMOTE_PORT', 'X_REAL_IP', 'ACCEPT'])
+        self.assertIs(proxy.META, meta)
+
+    def testMetaOverrides(self):
+        proxy = self.get_proxy([('X-Real-IP', '127.0.0.2'),
+                                ('Accept', 'text/html')])
+        meta = proxy.META
+        meta['REMOTE_ADDR'] = meta['X_REAL_IP']
+        meta['CUSTOM'] = 'value'
+        del meta['ACCEPT']
+        self.assertEqual(meta['REMOTE_ADDR'], '127.0.0.2')
+        self.assertEqual(
+            dict(meta),
+            {'REMOTE_ADDR': '127.0.0.2', 'REMOTE_PORT': 12345,
+             'X_REAL_IP': '127.0.0.2', 'CUSTOM': 'value'})
+        self.assertEqual(list(meta)[-1], 'CUSTOM')
+        with self.assertRaises(KeyError):
+            del meta['ACCEPT']
+        meta['ACCEPT'] = 'text/plain'
+        self.assertEqual(meta['ACCEPT'], 'text/plain')
+        self.assertEqual(proxy.headers['Accept'], 'text/html')
+
+    def testUnixSocketMeta(self):
+        proxy = self.get_proxy(peername='')
+        self.assertEqual(dict(proxy.META),
+                         {'REMOTE_ADDR': '', 'REMOTE_PORT': None})
+        self.assertIs(proxy.META, proxy.META)
+
+
+class ChunkedContent(object):
+    """ Request payload stream returning body by small chunks."""
+
+    def __init__(self, body, chunk_size):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.parser = None
+        self.max_buffer = 0
+
+    @asyncio.coroutine
+    def readany(self):
+        if self.parser is not None:
+            self.max_buffer = max(self.max_buffer, len(self.parser.buffer))
+        chunk = self.body[:self.chunk_size]
+        self.body = self.body[self.chunk_size:]
+        return chunk
+
+
+class MultipartParserTestCase(DvasyaTestCase):
+    boundary = b'Asrf456BGe4h'
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        super().tearDown()
+
+    def get_body(self, *parts):
+        delimiter = b'--' + self.boundary
+        lines = [b'preamble']
+        for headers, content in parts:
+            lines.append(delimiter)
+            lines.extend(headers)
+            lines.extend((b'', content))
+        lines.append(delimiter + b'--\r\nepilogue')
+        return b'\r\n'.join(lines)
+
+    def parse(self, body, chunk_size=7, **kwargs):
+        content = ChunkedContent(body, chunk_size)
+        parser = content.parser = MultipartParser(content, self.boundary,
+                                                  **kwargs)
+        data = self.loop.run_until_complete(parser.parse())
+        return data, content
+
+    def testParse(self):
+        # file content contains delimiter prefixes and no line breaks
+        file_content = (b'\r\n--' + self.boundary[:-1] + b'\xff') * 1000
+        body = self.get_body(
+            ([b'Content-Disposition: form-data; name="field"'],
+             'значение'.encode('cp1251')),
+            ([b'Content-Disposition: form-data; name="field"',
+              b'Content-Type: text/plain; charset=utf-8'],
+             'значение'.encode('utf-8')),
+            ([b'Content-Disposition: form-data; name="f"; filename="a.bin"',
+              b'Content-Type: application/octet-stream'],
+             file_content),
+            ([b'Content-Disposition: form-data; name="empty"; filename=""'],
+             b''),
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            data, content = self.parse(body, charset='cp1251',
+                                       max_memory_size=1024, temp_dir=tmp)
+        self.assertEqual(data.getall('field'), ['значение', 'значение'])
+        self.assertNotIn('empty', data)
+        f = data['f']
+        self.assertEqual((f.name, f.filename, f.content_type),
+                         ('f', 'a.bin', 'application/octet-stream'))
+        self.assertTrue(f.file._rolled)
+        self.assertEqual(f.file.read(), file_content)
+        self.assertEqual(content.body, b'')
+
+    def testBoundedMemory(self):
+        body = self.get_body(
+            ([b'Content-Disposition: form-data; name="f"; filename="a"'],
+             os.urandom(1024 * 1024)))
+        data, content = self.parse(body, chunk_size=4096)
+        self.assertLess(content.max_buffer, 4096 + 100)
+        self.assertEqual(len(data['f'].file.read()), 1024 * 1024)
+
+    def testMalformed(self):
+        disposition = b'Content-Disposition: form-data; name="a"'
+        body = self.get_body(([disposition], b'value'))
+        for invalid in (body[:-20],
+                        body.replace(b'form-data', b'inline'),
+                        body.replace(disposition, b'Invalid header')):
+            with self.assertRaises(MultipartError):
+                self.parse(invalid)
+
+    def testDataTooBig(self):
+        body = self.get_body(
+            ([b'Content-Disposition: form-data; name="a"'], b'1' * 60),
+            ([b'Content-Disposition: form-data; name="b"'], b'1' * 60))
+        self.parse(body, max_data_size=120)
+        with self.assertRaises(MultipartError):
+            self.parse(body, max_data_size=100)
+
+
+class BodySizeLimitTestCase(DvasyaServerTestCaseBase):
+    def testContentLength(self):
+        body = b'arg=' + b'1' * 60
+        with override_settings(MAX_BODY_SIZE=64):
+            result = self.client.post('/function/', body=body)
+            self.assertEqual(result.status, 200)
+            self.mock.reset_mock()
+            result = self.client.post('/function/', body=body + b'1')
+            self.assertEqual(result.status, 413)
+            self.assertFalse(self.mock.called)
+            # body of GET request is limited too
+            result = self.client.request('GET', '/function/', body + b'1')
+            self.assertEqual(result.status, 413)
+
+    def testRouteLimit(self):
+        result = self.client.post('/limited/', body=b'arg=' + b'1' * 12)
+        self.assertEqual(result.status, 200)
+        self.mock.reset_mock()
+        # route limit overrides global one
+        with override_settings(MAX_BODY_SIZE=1024):
+            result = self.client.post('/limited/', body=b'arg=' + b'1' * 13)
+        self.assertEqual(result.status, 413)
+        self.assertFalse(self.mock.called)
+        with self.assertRaises(ValueError):
+            url('^include/', [], max_body_size=16)
+
+    def testChunkedBody(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        content = ChunkedContent(b'1' * 100, 7)
+        request = mock.Mock(_read_bytes=None, content=content)
+        with self.assertRaises(HTTPRequestEntityTooLarge):
+            loop.run_until_complete(read_body(request, 50))
+        # stream is not read after limit is exceeded
+        self.assertEqual(len(content.body), 100 - 56)
+        self.assertIsNone(request._read_bytes)
+
+        request = mock.Mock(_read_bytes=None,
+                            content=ChunkedContent(b'1' * 100, 7))
+        self.assertEqual(loop.run_until_complete(read_body(request, 100)),
+                         b'1' * 100)
+        self.assertEqual(request._read_bytes, b'1' * 100)
+
+
 class DvasyaRequestParserTestCase(DvasyaServerTestCaseBase):
     def testSimpleGet(self):
         url = '/class/?arg1=val1&arg2=val2?&arg2=val3#hashtag'
@@ -59,6 +59,14 @@ class DjangoTestCase(DvasyaTestCase):
         peername = (meta['REMOTE_ADDR'], meta['REMOTE_PORT'])
         self.assertTupleEqual(peername, self.client.peername)
 
+    def testUnixSocketMeta(self):
+        self.client.peername = ''
+        response = self.client.get('/rest/')
+        self.assertEqual(response.status, 200)
+        meta = json.loads(response.text)['request']['META']
+        self.assertEqual((meta['REMOTE_ADDR'], meta['REMOTE_PORT']),
+                         ('', None))
+
     def testCaseInsensitiveHeaders(self):
         url = '/rest/'
         headers = {